@@ -61,7 +61,7 @@ namespace Graphs {
                 window.add_action (action);
             }
 
-            string[] settings_actions = {"center", "smoothen"};
+            string[] settings_actions = {"center", "combine", "resample", "smoothen"};
             GLib.Settings actions_settings = application.get_settings_child ("actions");
             foreach (string settings_action in settings_actions) {
                 window.add_action (actions_settings.create_action (settings_action));
@@ -87,6 +87,12 @@ namespace Graphs {
             });
             window.add_action (smoothen_settings_action);
 
+            var resample_settings_action = new SimpleAction ("resample_settings", null);
+            resample_settings_action.activate.connect (() => {
+                new ResampleDialog (window);
+            });
+            window.add_action (resample_settings_action);
+
             var select_all_action = new SimpleAction ("select_all", null);
             select_all_action.activate.connect (() => {
                 foreach (Item item in data) {
@@ -205,6 +211,12 @@ namespace Graphs {
             });
             window.add_action (export_data_action);
 
+            var export_items_actions = new SimpleActionGroup ();
+            export_items_actions.add_action (
+                application.get_settings_child ("export-items").create_action ("mode")
+            );
+            window.insert_action_group ("export-items", export_items_actions);
+
             var figure_settings_action = new SimpleAction ("figure_settings", null);
             figure_settings_action.activate.connect (() => {
                 new FigureSettingsDialog (window, null);
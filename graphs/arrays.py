@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Module for sharing immutable data arrays.
+
+Arrays are interned by their content hash, such that identical arrays in
+items, the undo history and project files are only kept in memory once.
+Interned arrays are released automatically once nothing references them
+anymore.
+"""
+import copy
+import hashlib
+import sys
+import weakref
+
+import numpy
+
+_ARRAYS = weakref.WeakValueDictionary()
+
+
+class FrozenArray(list):
+    """
+    Immutable list of numbers, identified by the hash of its content.
+
+    Copying returns the array itself. Instead of modifying an array in
+    place, a new list should be assigned.
+    """
+
+    def __init__(self, values, digest: str):
+        super().__init__(values)
+        self.digest = digest
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate amount of memory used by the array."""
+        return sys.getsizeof(self) + len(self) * sys.getsizeof(0.0)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, _memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenArray, (list(self), self.digest))
+
+    def _immutable(self, *_args, **_kwargs):
+        raise TypeError("FrozenArray is immutable, assign a new list instead")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = _immutable
+    sort = reverse = _immutable
+
+
+def get_digest(values) -> str:
+    """Get the content hash of an array of numbers."""
+    if isinstance(values, FrozenArray):
+        return values.digest
+    data = numpy.asarray(values, dtype="<f8").tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def intern(values) -> FrozenArray | None:
+    """
+    Get the interned array with the same content as `values`.
+
+    Returns None if `values` is not a one dimensional sequence of numbers.
+    """
+    if isinstance(values, FrozenArray):
+        return values
+    try:
+        array = numpy.asarray(values)
+    except ValueError:
+        return None
+    if array.ndim != 1 or array.dtype.kind not in "fiu":
+        return None
+    digest = get_digest(array)
+    try:
+        return _ARRAYS[digest]
+    except KeyError:
+        frozen = _ARRAYS[digest] = FrozenArray(values, digest)
+        return frozen
+
+
+def freeze(value):
+    """
+    Get an immutable copy of a value.
+
+    Lists of numbers are interned, also inside of dicts, lists and tuples.
+    Anything else is deep copied. This replaces `copy.deepcopy` for values
+    that may hold data arrays.
+    """
+    if isinstance(value, list):
+        frozen = intern(value)
+        if frozen is not None:
+            return frozen
+        return [freeze(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return {key: freeze(item) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+
+def collect(value, found: dict) -> None:
+    """Collect the interned arrays inside of a value in `found` by hash."""
+    if isinstance(value, FrozenArray):
+        found[value.digest] = value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            collect(item, found)
+    elif isinstance(value, dict):
+        for item in value.values():
+            collect(item, found)
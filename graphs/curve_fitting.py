@@ -1,17 +1,25 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Curve fitting module."""
+import functools
+import multiprocessing
+import os
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from gettext import gettext as _
 
-from gi.repository import Adw, Gio, Graphs, Gtk
+from gi.repository import Adw, GLib, Gio, Graphs, Gtk
 
-from graphs import utilities
+from graphs import fitting, utilities
 from graphs.canvas import Canvas
 from graphs.item import DataItem, FillItem
 
 import numpy
 
-from scipy.optimize import _minpack, curve_fit
+# Delay in milliseconds between the last fit request and the actual fit
+_FIT_DELAY = 150
+
+_preprocess = functools.lru_cache(maxsize=32)(utilities.preprocess)
 
 
 class CurveFittingDialog(Graphs.CurveFittingDialog):
@@ -27,6 +35,8 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
         self.connect("equation_change", self.on_equation_change)
         self.connect("fit_curve_request", self.fit_curve)
         self.connect("add_fit_request", self.add_fit)
+        self.connect("batch_fit_request", self.batch_fit)
+        self.connect("closed", self._on_closed)
         self.fitting_parameters = FittingParameterContainer()
         style = \
             application.get_figure_style_manager().get_system_style_params()
@@ -34,6 +44,16 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
         self.param = []
         self.sigma = []
         self.r2 = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._fit_source = None
+        self._fit_cancel_event = None
+        self._batch_executor = None
+        self._models = fitting.ModelCache()
+
+        # Keep array copies of the data, so the model can be evaluated in
+        # single vectorized calls
+        self._xdata = numpy.asarray(item.xdata, dtype=float)
+        self._ydata = numpy.asarray(item.ydata, dtype=float)
 
         # Generate items for the canvas
         self.data_curve = DataItem.new(
@@ -57,11 +77,22 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
             color="#1A5FB4",
             alpha=0.15,
         )
+        self.prediction_fill = FillItem.new(
+            style,
+            (
+                self.fitted_curve.xdata,
+                self.fitted_curve.ydata,
+                self.fitted_curve.ydata,
+            ),
+            color="#1A5FB4",
+            alpha=0.07,
+        )
 
         self._items = Gio.ListStore.new(Graphs.Item)
         self._items.append(self.fitted_curve)
         self._items.append(self.data_curve)
         self._items.append(self.fill)
+        self._items.append(self.prediction_fill)
 
         self.reload_canvas()
         self.setup()
@@ -90,10 +121,11 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
         Set the free variables and corresponding entry rows when the equation
         has been changed.
         """
-        processed_equation = utilities.preprocess(equation)
+        processed_equation = _preprocess(equation)
         self.set_equation_string(processed_equation)
-        free_variables = utilities.get_free_variables(processed_equation)
+        free_variables = self._get_free_variables()
         if len(free_variables) == 0:
+            self._cancel_fit()
             self.set_results(error="equation")
             return
         self.fitting_parameters.update(free_variables)
@@ -152,6 +184,7 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
 
                 for bound in [initial, lower_bound, upper_bound]:
                     if not _is_float(bound):
+                        self._cancel_fit()
                         self.set_results(error="value")
                         return
 
@@ -173,7 +206,9 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
                 params.set_lower_bound(str(lower_bound))
                 params.set_upper_bound(str(upper_bound))
 
-        if not error:
+        if error:
+            self._cancel_fit()
+        else:
             self.fit_curve()
 
     def set_results(self, error="") -> None:
@@ -192,10 +227,12 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
             buffer_string += _(
                 "Please enter valid fitting bounds \nto start the fit",
             )
-        else:
-            free_variables = utilities.get_free_variables(
-                self.get_equation_string(),
+        elif error == "selection":
+            buffer_string += _(
+                "Please select data items \nto fit",
             )
+        else:
+            free_variables = self._get_free_variables()
             for index, arg in enumerate(free_variables):
                 parameter = utilities.sig_fig_round(self.param[index], 3)
                 sigma = utilities.sig_fig_round(self.sigma[index], 3)
@@ -204,6 +241,35 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
                     buffer_string += f" (± {sigma})"
                 buffer_string += "\n"
             buffer_string += "\n" + _("Sum of R²: {R2}").format(R2=self.r2)
+        self._set_results_text(buffer_string)
+
+    def set_batch_results(self, rows: list[tuple[str, dict]]) -> None:
+        """Set the results dialog to the parameter table of a batch fit."""
+        free_variables = self._get_free_variables()
+        show_sigma = self.get_settings().get_enum("confidence") != 0
+        buffer_string = _("Results:") + "\n"
+        for name, result in rows:
+            buffer_string += f"\n{name}\n"
+            if result is None:
+                buffer_string += _("Fit was not successful") + "\n"
+                continue
+            for arg, param, sigma in \
+                    zip(free_variables, result["param"], result["sigma"]):
+                parameter = utilities.sig_fig_round(param, 3)
+                sigma = utilities.sig_fig_round(sigma, 3)
+                buffer_string += f"{arg}: {parameter}"
+                if show_sigma:
+                    buffer_string += f" (± {sigma})"
+                buffer_string += "\n"
+            r2 = result["r2"]
+            if r2 is not None:
+                r2 = utilities.sig_fig_round(r2, 3)
+            buffer_string += _("Sum of R²: {R2}").format(R2=r2)
+            buffer_string += "\n"
+        self._set_results_text(buffer_string)
+
+    def _set_results_text(self, buffer_string: str) -> None:
+        """Set the text of the results dialog, highlighting the title."""
         self.get_text_view().get_buffer().set_text(buffer_string)
         bold_tag = Gtk.TextTag(weight=700)
         self.get_text_view().get_buffer().get_tag_table().add(bold_tag)
@@ -222,123 +288,214 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
 
     def fit_curve(self, *_args) -> bool:
         """
-        Fit the data to the equation in the entry.
+        Request a new fit of the data to the equation in the entry.
 
-        Returns a boolean indicating whether the fit was succesfull or not.
+        The fit is debounced and performed on a worker thread, such that
+        requests in quick succession only result in a single fit. Any fit
+        that is still pending or running gets superseded by the new request.
+        Returns a boolean indicating whether the fit could be requested.
         """
+        self._cancel_fit()
+        if self._models.get(self.get_equation_string())["function"] is None:
+            return False
+        self._fit_source = GLib.timeout_add(_FIT_DELAY, self._start_fit)
+        return True
 
-        def _get_equation_name(equation_name, values):
-            """Obtain the equation name with the fitted parameter values."""
-            free_variables = utilities.get_free_variables(
-                self.get_equation_string(),
-            )
-            var_to_val = dict(zip(free_variables, values))
-            for var, val in var_to_val.items():
-                if var.lower() == "e":
-                    pattern = r"(?<!\d)[Ee]|(?!\d)[Ee](?![-+]?\d)"
-                else:
-                    pattern = (
-                        r"((?<=[\d\)])|\b)" + var
-                        + r"((?=[\u2070-\u209f\u00b0-\u00be])|\b)"
-                    )
-                value = utilities.sig_fig_round(val, 3)
-                equation_name = \
-                    re.sub(pattern, f"({value})", equation_name)
-            return equation_name
-
-        function = utilities.string_to_function(self.get_equation_string())
-        if function is None:
-            return
+    def _cancel_fit(self) -> None:
+        """Cancel the pending and running fits."""
+        if self._fit_source is not None:
+            GLib.source_remove(self._fit_source)
+            self._fit_source = None
+        if self._fit_cancel_event is not None:
+            self._fit_cancel_event.set()
+            self._fit_cancel_event = None
+
+    def _get_free_variables(self) -> list:
+        """Get the free variables of the current equation."""
+        return self._models.get(self.get_equation_string())["free_variables"]
+
+    def _get_fit_options(self) -> dict:
+        """Get the options for large datasets, see `fitting.fit`."""
+        settings = self.get_settings()
+        return {
+            "coarse_to_fine": settings.get_boolean("coarse-to-fine"),
+            "early_stopping": settings.get_boolean("early-stopping"),
+        }
+
+    def _start_fit(self) -> bool:
+        """Snapshot the fitting state and submit the fit to the worker."""
+        self._fit_source = None
+        self._fit_cancel_event = threading.Event()
+        model = self._models.get(self.get_equation_string())
+        future = self._executor.submit(
+            fitting.fit_model,
+            model,
+            self._xdata,
+            self._ydata,
+            self.fitting_parameters.get_p0(),
+            self.fitting_parameters.get_bounds(),
+            self.get_settings().get_string("optimization"),
+            self.get_settings().get_enum("confidence"),
+            self._fit_cancel_event,
+            **self._get_fit_options(),
+        )
+        cancel_event = self._fit_cancel_event
+        future.add_done_callback(
+            lambda future:
+            GLib.idle_add(self._on_fit_finished, future, cancel_event),
+        )
+        return GLib.SOURCE_REMOVE
+
+    def _on_fit_finished(self, future, cancel_event) -> bool:
+        """Apply the result of a fit on the main loop."""
+        if cancel_event.is_set():
+            return GLib.SOURCE_REMOVE
+        self._fit_cancel_event = None
         try:
-            self.param, self.param_cov = curve_fit(
-                function,
-                self.data_curve.xdata, self.data_curve.ydata,
-                p0=self.fitting_parameters.get_p0(),
-                bounds=self.fitting_parameters.get_bounds(),
-                nan_policy="omit",
-                method=self.get_settings().get_string("optimization"),
-            )
-        except (ValueError, TypeError, _minpack.error, RuntimeError):
+            result = future.result()
+        except fitting.FitCancelledError:
+            return GLib.SOURCE_REMOVE
+        except Exception:
+            result = None
+        if result is None:
             # Cancel fit if not successful
             self.set_results(error="equation")
-            return
-        xdata = numpy.linspace(
-            min(self.data_curve.xdata),
-            max(self.data_curve.xdata),
-            5000,
-        )
-        ydata = [function(x, *self.param) for x in xdata]
-
-        name = _get_equation_name(
+            return GLib.SOURCE_REMOVE
+        self.param = result["param"]
+        self.param_cov = result["param_cov"]
+        self.sigma = result["sigma"]
+        if result["r2"] is not None:
+            self.r2 = utilities.sig_fig_round(result["r2"], 3)
+
+        name = self._get_equation_name(
             str(self.get_custom_equation().get_text()).lower(),
             self.param,
         )
         self.fitted_curve.set_name(f"Y = {name}")
-        self.fitted_curve.ydata, self.fitted_curve.xdata = (ydata, xdata)
-        self.get_confidence(function)
+        self.fitted_curve.ydata, self.fitted_curve.xdata = (
+            result["ydata"],
+            result["xdata"],
+        )
+        self.get_canvas().axes[0].relim()  # Reset limits
+        # Collapse bands that could not be computed onto the fitted curve,
+        # such that no bands of a previous fit remain
+        empty_band = (result["xdata"], result["ydata"], result["ydata"])
+        self.fill.props.data = result["fill"] \
+            if result["fill"] is not None else empty_band
+        self.prediction_fill.props.data = result["prediction"] \
+            if result["prediction"] is not None else empty_band
         self.set_results()
-        return True
+        return GLib.SOURCE_REMOVE
+
+    def _get_equation_name(self, equation_name: str, values: list) -> str:
+        """Obtain the equation name with the fitted parameter values."""
+        free_variables = self._get_free_variables()
+        var_to_val = dict(zip(free_variables, values))
+        for var, val in var_to_val.items():
+            if var.lower() == "e":
+                pattern = r"(?<!\d)[Ee]|(?!\d)[Ee](?![-+]?\d)"
+            else:
+                pattern = (
+                    r"((?<=[\d\)])|\b)" + var
+                    + r"((?=[\u2070-\u209f\u00b0-\u00be])|\b)"
+                )
+            value = utilities.sig_fig_round(val, 3)
+            equation_name = \
+                re.sub(pattern, f"({value})", equation_name)
+        return equation_name
 
-    def get_confidence(self, function: str) -> None:
+    @staticmethod
+    def batch_fit(self) -> None:
         """
-        Obtain the confidence interval from the fit.
+        Fit the equation to all selected data items.
 
-        Get the confidence interval in terms of the standard deviation
-        resulting from the covariance in the plot. The bounds are navively
-        calculated by using the extremes on each parameter for both sides
-        of the bounds.
+        The items are divided into contiguous chunks, which are fitted in
+        parallel worker processes. Within a chunk, every fit is started from
+        the parameters of the previous item. Once all chunks are done, the
+        parameter table is shown and the fitted curves are added to the data.
         """
-        # Get standard deviation
-        self.get_canvas().axes[0].relim()  # Reset limits
-        self.sigma = numpy.sqrt(numpy.diagonal(self.param_cov))
-        self.sigma *= self.get_settings().get_enum("confidence")
-        try:
-            fitted_y = [
-                function(x, *self.param) for x in self.data_curve.xdata
-            ]
-        except (OverflowError, ZeroDivisionError):
+        if self._batch_executor is not None:
             return
-        ss_res = numpy.sum(
-            (numpy.asarray(self.data_curve.ydata)
-             - numpy.asarray(fitted_y))**2,
-        )
-        ss_sum = numpy.sum((self.data_curve.ydata - numpy.mean(fitted_y))**2)
-        self.r2 = utilities.sig_fig_round(1 - (ss_res / ss_sum), 3)
-
-        # Get confidence band
-        upper_bound = function(
-            self.fitted_curve.xdata,
-            *(self.param + self.sigma),
+        items = [
+            item for item in self.props.window.get_data()
+            if item.get_selected() and isinstance(item, DataItem)
+        ]
+        if not items:
+            self.set_results(error="selection")
+            return
+        datasets = [(
+            numpy.asarray(item.xdata, dtype=float),
+            numpy.asarray(item.ydata, dtype=float),
+        ) for item in items]
+        workers = min(len(datasets), os.cpu_count() or 1)
+        chunk_size = -(-len(datasets) // workers)
+        # Spawn fresh interpreters, forking a running GTK application is
+        # not safe
+        self._batch_executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
         )
-        lower_bound = function(
-            self.fitted_curve.xdata,
-            *(self.param - self.sigma),
+        futures = [
+            self._batch_executor.submit(
+                fitting.fit_batch,
+                self.get_equation_string(),
+                datasets[start:start + chunk_size],
+                self.fitting_parameters.get_p0(),
+                self.fitting_parameters.get_bounds(),
+                self.get_settings().get_string("optimization"),
+                self.get_settings().get_enum("confidence"),
+                **self._get_fit_options(),
+            ) for start in range(0, len(datasets), chunk_size)
+        ]
+        for future in futures:
+            future.add_done_callback(
+                lambda _future: GLib.idle_add(
+                    self._on_batch_fit_finished, items, futures,
+                ),
+            )
+        self._set_results_text(
+            _("Results:") + "\n"
+            + _("Fitting {amount} items…").format(amount=len(items)),
         )
 
-        # Filter non-finite values from the bounds
-        lower_bound = lower_bound[numpy.isfinite(lower_bound)]
-        upper_bound = upper_bound[numpy.isfinite(upper_bound)]
-
-        # Cancel if there's no valid values left after filtering non-finite
-        if len(upper_bound) == 0 or len(lower_bound) == 0:
-            return
+    def _on_batch_fit_finished(self, items: list, futures: list) -> bool:
+        """Collect the results once all chunks of a batch fit are done."""
+        if self._batch_executor is None \
+                or not all(future.done() for future in futures):
+            return GLib.SOURCE_REMOVE
+        self._batch_executor.shutdown(wait=False)
+        self._batch_executor = None
+        try:
+            results = [
+                result for future in futures for result in future.result()
+            ]
+        except Exception:
+            self.set_results(error="equation")
+            return GLib.SOURCE_REMOVE
 
-        span = max(self.fitted_curve.ydata) - min(self.fitted_curve.ydata)
-        middle = \
-            (max(self.fitted_curve.ydata) - min(self.fitted_curve.ydata)) / 2
-
-        # Don't try to draw complicated and resource-hogging bounds when
-        # far out of range, instead set them to be single-values far away
-        if max(upper_bound) > middle + 1e5 * span:
-            upper_bound = [middle + 1e5 * span]
-        if min(lower_bound) < middle - 1e5 * span:
-            lower_bound = [middle - 1e5 * span]
-
-        self.fill.props.data = (
-            self.fitted_curve.props.xdata,
-            lower_bound,
-            upper_bound,
-        )
+        self.set_batch_results([
+            (item.get_name(), result) for item, result in zip(items, results)
+        ])
+        data = self.props.window.get_data()
+        new_items = [
+            DataItem.new(
+                data.get_selected_style_params(),
+                name=_("Fit of {name}").format(name=item.get_name()),
+                xdata=result["xdata"].tolist(),
+                ydata=result["ydata"].tolist(),
+            ) for item, result in zip(items, results) if result is not None
+        ]
+        if new_items:
+            data.add_items(new_items)
+        return GLib.SOURCE_REMOVE
+
+    def _on_closed(self, _dialog) -> None:
+        """Stop fitting once the dialog is closed."""
+        self._cancel_fit()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown(wait=False, cancel_futures=True)
+            self._batch_executor = None
 
     @staticmethod
     def add_fit(self) -> None:
@@ -348,8 +505,8 @@ class CurveFittingDialog(Graphs.CurveFittingDialog):
             DataItem.new(
                 data.get_selected_style_params(),
                 name=self.fitted_curve.get_name(),
-                xdata=list(self.fitted_curve.xdata),
-                ydata=list(self.fitted_curve.ydata),
+                xdata=numpy.asarray(self.fitted_curve.xdata).tolist(),
+                ydata=numpy.asarray(self.fitted_curve.ydata).tolist(),
             ),
         ])
         self.close()
@@ -52,6 +52,7 @@ namespace Graphs {
         protected signal bool equation_change (string equation);
         protected signal void fit_curve_request ();
         protected signal void add_fit_request ();
+        protected signal void batch_fit_request ();
 
         protected void setup () {
             var application = window.application as Application;
@@ -72,6 +73,11 @@ namespace Graphs {
             });
             action_map.add_action (confidence_action);
             action_map.add_action (optimization_action);
+            foreach (string key in new string[] {"coarse-to-fine", "early-stopping"}) {
+                Action action = settings.create_action (key);
+                action.notify.connect (emit_fit_curve_request);
+                action_map.add_action (action);
+            }
             insert_action_group ("win", action_map);
 
             equation.set_selected (settings.get_enum ("equation"));
@@ -115,6 +121,11 @@ namespace Graphs {
         private void emit_add_fit_request () {
             add_fit_request.emit ();
         }
+
+        [GtkCallback]
+        private void emit_batch_fit_request () {
+            batch_fit_request.emit ();
+        }
     }
 
     [GtkTemplate (ui = "/se/sjoerd/Graphs/ui/fitting-parameters.ui")]
@@ -1,22 +1,38 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Data management module."""
+import collections
+import contextlib
 import copy
+import functools
 import logging
 import math
+import sys
 from gettext import gettext as _
 
 from gi.repository import Gio, Graphs
 
-from graphs import item, misc, project, style_io, utilities
+from graphs import (
+    arrays,
+    history_store,
+    item,
+    misc,
+    project,
+    style_io,
+    utilities,
+)
 
 from matplotlib import RcParams
 
 import numpy
 
+# Maximum amount of history states, including the initial state
+_HISTORY_LENGTH = 101
 _FIGURE_SETTINGS_HISTORY_IGNORELIST = misc.LIMITS + [
     "min_selected",
     "max_selected",
 ]
+# Amount of updates appended to a project file before it is rewritten
+_PROJECT_UPDATE_LIMIT = 32
 
 
 class Data(Graphs.Data):
@@ -31,9 +47,16 @@ class Data(Graphs.Data):
         self.setup()
         limits = self.props.figure_settings.get_limits()
         self._history_states = [([], limits)]
+        self._history_arrays = {}
+        self._history_cache = collections.OrderedDict()
+        self._spilled_arrays = None
+        self._prune_stored = False
+        self._pending_saves = 0
+        self._transaction_depth = 0
         self._history_pos = -1
         self._view_history_states = [limits]
         self._view_history_pos = -1
+        self._reset_save_state(None, 0)
         self._set_data_copy()
         self.props.figure_settings.connect(
             "notify",
@@ -108,6 +131,7 @@ class Data(Graphs.Data):
     @staticmethod
     def _on_position_changed(self, index1: int, index2: int) -> None:
         """Change item position of index2 to that of index1."""
+        self._flush_item_changes()
         self._current_batch.append((3, (index2, index1)))
 
     def add_items(self, items: misc.ItemList) -> None:
@@ -141,6 +165,7 @@ class Data(Graphs.Data):
                 _append_used_color(color)
         used_names = set(self.get_names())
         prev_size = self.get_n_items()
+        self._flush_item_changes()
         for new_item in items:
             item_name = new_item.get_name()
             if item_name in used_names:
@@ -185,8 +210,10 @@ class Data(Graphs.Data):
                         break
 
             self._add_item(new_item, -1, False)
-            change = (1, copy.deepcopy(new_item.to_dict()))
+            change = (1, arrays.freeze(new_item.to_dict()))
             self._current_batch.append(change)
+            # Later changes within the same history state start from here
+            self._data_copy[new_item.get_uuid()] = change[1]
         self.emit("items_changed", prev_size, 0, len(items))
         self._optimize_limits()
         self._add_history_state()
@@ -194,9 +221,10 @@ class Data(Graphs.Data):
     @staticmethod
     def _on_delete_request(self, items: misc.ItemList, _num):
         """Delete specified items."""
+        self._flush_item_changes()
         for item_ in items:
             self._current_batch.append(
-                (2, (self.index(item_), item_.to_dict())),
+                (2, (self.index(item_), arrays.freeze(item_.to_dict()))),
             )
             x_position = item_.get_xposition()
             y_position = item_.get_yposition() + 2
@@ -218,15 +246,30 @@ class Data(Graphs.Data):
 
     @staticmethod
     def _on_item_changed(self, item_, prop) -> None:
-        self._current_batch.append((
-            0,
-            (
-                item_.get_uuid(),
-                prop,
-                copy.deepcopy(self._data_copy[item_.get_uuid()][prop]),
-                copy.deepcopy(item_.get_property(prop)),
-            ),
-        ))
+        """
+        Mark a property of an item as changed.
+
+        The change is only recorded once the history state is added, or when
+        another kind of change is recorded, see `_flush_item_changes`. Any
+        amount of notifications for the same property thereby result in a
+        single change, without copying the value on every notification.
+        """
+        self._changed_uuids.add(item_.get_uuid())
+        self._item_changes[item_.get_uuid(), prop] = item_
+
+    def _flush_item_changes(self) -> None:
+        """Record pending property changes in the current batch."""
+        for (uuid, prop), item_ in self._item_changes.items():
+            self._current_batch.append((
+                0,
+                (
+                    uuid,
+                    prop,
+                    self._data_copy[uuid][prop],
+                    arrays.freeze(item_.get_property(prop)),
+                ),
+            ))
+        self._item_changes.clear()
 
     def _on_figure_settings_change(self, figure_settings, param) -> None:
         if param.name in _FIGURE_SETTINGS_HISTORY_IGNORELIST:
@@ -241,9 +284,15 @@ class Data(Graphs.Data):
         ))
 
     def _set_data_copy(self) -> None:
-        """Set a deep copy for the data."""
+        """
+        Set a deep copy for the data.
+
+        Data arrays are interned, such that they are shared with the items
+        and history states holding the same data, instead of being copied.
+        """
         self._current_batch: list = []
-        self._data_copy = copy.deepcopy({
+        self._item_changes: dict = {}
+        self._data_copy = arrays.freeze({
             item_.get_uuid(): item_.to_dict()
             for item_ in self
         })
@@ -253,37 +302,202 @@ class Data(Graphs.Data):
             for prop in dir(self.props.figure_settings.props)
         })
 
+    @contextlib.contextmanager
+    def transaction(self, old_limits: misc.Limits = None):
+        """
+        Group all changes made within the context into one history state.
+
+        Adding history states is deferred while inside the context, the
+        state is added once the outermost transaction ends. If the context
+        is left with an exception, the changes remain pending instead.
+        """
+        self._transaction_depth += 1
+        try:
+            yield
+        finally:
+            self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._add_history_state(old_limits)
+
     def add_history_state_with_limits(self, old_limits: misc.Limits) -> None:
         """Add a state to the clipboard with old_limits set."""
         self._add_history_state(old_limits)
 
     def _add_history_state(self, old_limits: misc.Limits = None) -> None:
         """Add a state to the clipboard."""
+        if self._transaction_depth > 0:
+            return
+        self._flush_item_changes()
         if not self._current_batch:
             return
-        if self._history_pos != -1:
+        dropped_history = self._dropped_history
+        truncated = self._history_pos != -1
+        if truncated:
             self._history_states = self._history_states[:self._history_pos + 1]
         self._history_pos = -1
         self._history_states.append(
             (self._current_batch, self.get_figure_settings().get_limits()),
         )
+        # Track which states still match the saved project file
+        self._saved_history = min(
+            self._saved_history,
+            len(self._history_states) - 1,
+        )
         if old_limits is not None:
-            old_state = self._history_states[-2][1]
+            old_state = self._get_history_state(-2)[1]
             for index in range(8):
                 old_state[index] = old_limits[index]
+            self._saved_history = min(
+                self._saved_history,
+                len(self._history_states) - 2,
+            )
         self.props.can_redo = False
         self.props.can_undo = True
-        # Keep history states length limited to 100 spots
-        if len(self._history_states) > 101:
-            self._history_states = self._history_states[1:]
+        self._limit_history()
+        if truncated or self._dropped_history != dropped_history:
+            self._prune_stored_arrays()
+        self._cache_history_state(self._history_states[-1])
         self._set_data_copy()
         self.props.unsaved = True
 
+    def _limit_history(self) -> None:
+        """
+        Evict the oldest history states that exceed the limits.
+
+        The history is limited to `_HISTORY_LENGTH` states, and to the memory
+        budget from the settings. At least one change is always kept, so the
+        latest change can be undone.
+        """
+        budget = self.get_application().get_settings_child(
+            "history",
+        ).get_int("memory-budget") * 1024 * 1024
+        history_arrays = [
+            self._get_history_arrays(state) for state in self._history_states
+        ]
+        while len(history_arrays) > 2:
+            size = self._get_history_size(history_arrays)
+            if len(history_arrays) <= _HISTORY_LENGTH and size <= budget:
+                break
+            history_arrays.pop(0)
+            self._history_states = self._history_states[1:]
+            self._dropped_history += 1
+            self._saved_history = max(self._saved_history - 1, 0)
+        self.props.history_size = self._get_history_size(history_arrays)
+
+    def _get_history_arrays(self, state) -> dict:
+        """
+        Get the memory used by a history state.
+
+        Returns a dict with the size of every array held by the state by its
+        hash, such that arrays shared between states are counted once. The
+        encoded form of arrays loaded from the project file is keyed by
+        `("stored", hash)`.
+        """
+        if isinstance(state, str):
+            digests = project.get_array_references(state)
+            sizes = {id(state): sys.getsizeof(state)}
+        else:
+            found = {}
+            arrays.collect(state, found)
+            digests = list(found)
+            sizes = {digest: array.nbytes for digest, array in found.items()}
+        # Loaded arrays stay in memory in their encoded form until pruned,
+        # also once decoded. Spilled arrays are on disk and don't take up
+        # memory.
+        for digest in digests:
+            if digest in self._history_arrays:
+                sizes["stored", digest] = \
+                    sys.getsizeof(self._history_arrays[digest])
+        return sizes
+
+    @staticmethod
+    def _get_history_size(history_arrays: list[dict]) -> int:
+        sizes = {}
+        for state_arrays in history_arrays:
+            sizes.update(state_arrays)
+        return sum(sizes.values())
+
+    def _get_history_state(self, index: int) -> tuple:
+        """
+        Get a history state.
+
+        States loaded from a project file are kept in their encoded form
+        until they are accessed for the first time.
+        """
+        state = self._history_states[index]
+        if isinstance(state, str):
+            state = self._history_states[index] = \
+                project.decode_history_state(state, self._get_stored_arrays())
+        self._cache_history_state(state)
+        return state
+
+    def _cache_history_state(self, state) -> None:
+        """
+        Mark a decoded history state as recently used.
+
+        If spilling to disk is enabled, only the most recently used states
+        are kept in memory. Others are encoded again with their arrays stored
+        on disk, and are decoded once they are accessed again.
+        """
+        settings = self.get_application().get_settings_child("history")
+        if not settings.get_boolean("spill-to-disk"):
+            return
+        if self._spilled_arrays is None:
+            self._spilled_arrays = history_store.SpilledArrays()
+        self._history_cache[id(state)] = state
+        self._history_cache.move_to_end(id(state))
+        cached_states = max(settings.get_int("cached-states"), 1)
+        stored_arrays = self._get_stored_arrays()
+        while len(self._history_cache) > cached_states:
+            old_state = self._history_cache.popitem(last=False)[1]
+            for index, history_state in enumerate(self._history_states):
+                if history_state is old_state:
+                    self._history_states[index] = \
+                        project.encode_history_state(old_state, stored_arrays)
+                    break
+
+    def _prune_stored_arrays(self) -> None:
+        """
+        Remove stored arrays that no encoded history state refers to anymore.
+
+        These are the arrays loaded from the project file and the spilled
+        arrays. Saves that are still being written may read arrays of states
+        that were dropped since, so pruning is postponed until they are done.
+        """
+        if self._pending_saves > 0:
+            self._prune_stored = True
+            return
+        self._prune_stored = False
+        references = set()
+        for state in self._history_states:
+            if isinstance(state, str):
+                references.update(project.get_array_references(state))
+        for digest in set(self._history_arrays) - references:
+            del self._history_arrays[digest]
+        if self._spilled_arrays is not None:
+            self._spilled_arrays.discard(
+                set(self._spilled_arrays) - references,
+            )
+
+    def _get_stored_arrays(self):
+        """
+        Get the encoded arrays of the history states.
+
+        These are the arrays loaded from the project file, and the arrays
+        spilled to disk if any. New arrays are stored on disk.
+        """
+        if self._spilled_arrays is None:
+            return self._history_arrays
+        return collections.ChainMap(
+            self._spilled_arrays,
+            self._history_arrays,
+        )
+
     def _undo(self) -> None:
         """Undo the latest change that was added to the clipboard."""
         if not self.props.can_undo:
             return
-        batch = self._history_states[self._history_pos][0]
+        batch = self._get_history_state(self._history_pos)[0]
         self._history_pos -= 1
         for change_type, change in reversed(batch):
             if change_type == 0:
@@ -305,7 +519,7 @@ class Data(Graphs.Data):
                 )
         self.notify("items_selected")
         self.get_figure_settings().set_limits(
-            self._history_states[self._history_pos][1],
+            self._get_history_state(self._history_pos)[1],
         )
         self.props.can_redo = True
         self.props.can_undo = \
@@ -318,7 +532,7 @@ class Data(Graphs.Data):
         if not self.props.can_redo:
             return
         self._history_pos += 1
-        state = self._history_states[self._history_pos]
+        state = self._get_history_state(self._history_pos)
         for change_type, change in state[0]:
             if change_type == 0:
                 self[change[0]].set_property(change[1], change[3])
@@ -503,6 +717,7 @@ class Data(Graphs.Data):
                 for key in dir(figure_settings.props)
             },
             "history-states": self._history_states,
+            "history-arrays": self._get_stored_arrays(),
             "history-position": self._history_pos,
             "view-history-states": self._view_history_states,
             "view-history-position": self._view_history_pos,
@@ -515,15 +730,28 @@ class Data(Graphs.Data):
         for key, value in project_dict["figure-settings"].items():
             if figure_settings.get_property(key) != value:
                 figure_settings.set_property(key, value)
-        self.set_items([item.new_from_dict(d) for d in project_dict["data"]])
+        self.set_items([
+            item.new_from_dict(arrays.freeze(d)) for d in project_dict["data"]
+        ])
 
-        # Set clipboard
+        # Set clipboard, history states are only decoded once needed
         self._set_data_copy()
-        self._history_states = project_dict["history-states"]
+        self._history_states = list(project_dict["history-states"])
+        self._history_arrays = project_dict["history-arrays"]
+        self._history_cache.clear()
+        # Saves in progress keep the previous store open until they are done
+        self._spilled_arrays = None
         self._history_pos = project_dict["history-position"]
         self._view_history_states = project_dict["view-history-states"]
         self._view_history_pos = project_dict["view-history-position"]
         self.unsaved = False
+        self._reset_save_state(None, 0)
+        # Updates merged from the project file may hold arrays of states
+        # that were dropped since
+        self._prune_stored_arrays()
+        self.props.history_size = self._get_history_size([
+            self._get_history_arrays(state) for state in self._history_states
+        ])
 
         # Set clipboard/view buttons
         self.props.can_undo = \
@@ -533,8 +761,86 @@ class Data(Graphs.Data):
             abs(self._view_history_pos) < len(self._view_history_states)
         self.props.can_view_forward = self._view_history_pos < -1
 
+    def _reset_save_state(self, file: Gio.File, project_updates: int) -> None:
+        """
+        Mark the current project as completely saved to file.
+
+        With file None, the next save writes the complete project.
+        """
+        self._saved_file = file
+        self._saved_uuids = {item_.get_uuid() for item_ in self}
+        self._changed_uuids = set()
+        self._saved_history = len(self._history_states)
+        self._dropped_history = 0
+        self._project_updates = project_updates
+
     def _save(self) -> None:
-        project.save_project_dict(self.props.file, self.get_project_dict())
+        """
+        Save the project in the background.
+
+        Only a cheap snapshot is taken here, shallow copies of the lists
+        ensure that edits made while saving don't end up in the file.
+
+        If the project was saved to the same file before, only an update
+        holding the changed items and new history states is appended to the
+        file. After `_PROJECT_UPDATE_LIMIT` updates, the file is compacted
+        by saving the complete project again.
+        """
+        file = self.props.file
+        if self._saved_file is not None and self._saved_file.equal(file) \
+                and self._project_updates < _PROJECT_UPDATE_LIMIT:
+            project_update = self.get_project_dict()
+            project_update["data"] = [
+                item_.get_uuid() if item_.get_uuid() in self._saved_uuids
+                and item_.get_uuid() not in self._changed_uuids
+                else self._copy_item_dict(item_.to_dict())
+                for item_ in self
+            ]
+            project_update["history-states"] = \
+                self._history_states[self._saved_history:]
+            project_update["history-arrays"] = self._get_stored_arrays()
+            project_update["history-dropped"] = self._dropped_history
+            project_update["history-kept"] = self._saved_history
+            project_update["view-history-states"] = \
+                list(project_update["view-history-states"])
+            self._pending_saves += 1
+            project.save_project_update(
+                file, project_update, functools.partial(self._on_saved, file),
+            )
+            self._reset_save_state(file, self._project_updates + 1)
+            return
+
+        project_dict = self.get_project_dict()
+        for item_dict in project_dict["data"]:
+            self._copy_item_dict(item_dict)
+        project_dict["history-states"] = list(project_dict["history-states"])
+        project_dict["view-history-states"] = \
+            list(project_dict["view-history-states"])
+        self._pending_saves += 1
+        project.save_project_dict(
+            file, project_dict, functools.partial(self._on_saved, file),
+        )
+        self._reset_save_state(file, 0)
+
+    @staticmethod
+    def _copy_item_dict(item_dict: dict) -> dict:
+        for key, value in item_dict.items():
+            if isinstance(value, list) \
+                    and not isinstance(value, arrays.FrozenArray):
+                item_dict[key] = list(value)
+        return item_dict
+
+    def _on_saved(self, file: Gio.File, error: Exception) -> bool:
+        self._pending_saves -= 1
+        if self._prune_stored:
+            self._prune_stored_arrays()
+        if error is not None:
+            logging.error("Could not save project", exc_info=error)
+            # The file no longer matches, so the next save is a full save
+            self._saved_file = None
+            self.props.unsaved = True
+        self.emit("saved", file, error is None)
+        return False
 
     @staticmethod
     def _on_load_request(self, file: Gio.File) -> str:
@@ -550,4 +856,6 @@ class Data(Graphs.Data):
         except Exception:
             self.load_from_project_dict(current_data)
             return _("Failed to load project")
+        if project_dict["project-updates"] is not None:
+            self._reset_save_state(file, project_dict["project-updates"])
         return ""
@@ -14,6 +14,7 @@ namespace Graphs {
         public bool can_view_forward { get; protected set; default = false; }
         public File file { get; set; }
         public bool unsaved { get; set; default = false; }
+        public uint64 history_size { get; protected set; default = 0; }
         public SingleSelection style_selection_model { get; private set; }
         public bool items_selected {
             get {
@@ -41,6 +42,7 @@ namespace Graphs {
         private Gee.AbstractList<Item> _items;
 
         public signal void style_changed (bool recolor_items);
+        public signal void saved (File file, bool success);
         protected signal void python_method_request (string method);
         protected signal void position_changed (uint index1, uint index2);
         protected signal void item_changed (Item item, string prop_name);
@@ -1,65 +1,261 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Module for Exporting data."""
+import contextlib
+import gzip
+import logging
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from gettext import gettext as _
 
-from gi.repository import Gio, Graphs
+from gi.repository import Adw, GLib, Gio, Graphs
+
+import gio_pyio
 
 from graphs import utilities
 from graphs.item import DataItem, EquationItem
 
+import numpy
+
+_EXPORT_MODES = {
+    # name: suffix
+    "columns": ".txt",
+    "compressed": ".txt.gz",
+    "numpy": ".npz",
+}
+
+# Amount of rows that get formatted in a single call when writing text
+_CHUNK_SIZE = 65536
+
 
 def export_items(
+    window: Graphs.Window,
     mode: str,
     file: Gio.File,
     items: list[Graphs.Item],
-    figure_settings: Graphs.FigureSettings,
 ) -> None:
-    """Export items in specified format."""
-    callback = getattr(sys.modules[__name__], "_export_" + mode)
-    callback(file, items, figure_settings)
-
+    """
+    Export items in specified format.
 
-def _export_columns(
-    file: Gio.File,
-    items: list[Graphs.Item],
-    figure_settings: Graphs.FigureSettings,
-) -> None:
-    """Save Items in columns format."""
-    if len(items) > 1:
-        for item in items:
-            name = f"{item.get_name()}.txt"
-            _save_item(
-                file.get_child_for_display_name(name),
+    When a single item is exported, the mode is guessed from the suffix of
+    the chosen file, falling back to the given mode. When multiple items are
+    exported, every item is written to its own file in the given directory.
+    """
+    figure_settings = window.get_data().get_figure_settings()
+    if len(items) == 1:
+        mode = _guess_export_mode(file, mode)
+        jobs = [_create_job(file, items[0], figure_settings)]
+    else:
+        suffix = _EXPORT_MODES[mode]
+        jobs = [
+            _create_job(
+                file.get_child_for_display_name(f"{item.get_name()}{suffix}"),
                 item,
                 figure_settings,
-            )
-    else:
-        _save_item(file, items[0], figure_settings)
+            ) for item in items
+        ]
+    _ExportTask(window, mode, jobs).start()
 
 
-def _save_item(
+def _guess_export_mode(file: Gio.File, default: str) -> str:
+    filename = Graphs.tools_get_filename(file).lower()
+    # Check longest suffixes first, so .txt.gz is not mistaken for .txt
+    for mode, suffix in sorted(
+        _EXPORT_MODES.items(),
+        key=lambda mode_suffix: len(mode_suffix[1]),
+        reverse=True,
+    ):
+        if filename.endswith(suffix):
+            return mode
+    return default
+
+
+def _create_job(
     file: Gio.File,
     item: DataItem | EquationItem,
     figure_settings: Graphs.FigureSettings,
-) -> None:
-    """Save Item in columns format."""
-    delimiter = "\t"
-    fmt = delimiter.join(["%.12e"] * 2)
-    xlabel, ylabel = item.get_xlabel(), item.get_ylabel()
-    stream = Gio.DataOutputStream.new(
-        file.replace(None, False, Gio.FileCreateFlags.NONE, None),
-    )
-    if xlabel != "" and ylabel != "":
-        stream.stream(xlabel + delimiter + ylabel + "\n")
+) -> dict:
+    """
+    Snapshot everything needed to export an item.
+
+    This is done on the main thread, so the workers never have to touch
+    GObject properties. Equations are only sampled later on in the worker.
+    """
+    job = {
+        "file": file,
+        "name": item.get_name(),
+        "xlabel": item.get_xlabel(),
+        "ylabel": item.get_ylabel(),
+        "xdata": None,
+        "ydata": None,
+        "equation": None,
+        "limits": None,
+    }
     if isinstance(item, DataItem):
-        xdata, ydata = item.xdata, item.ydata
+        # Shallow copies, so later edits don't end up in a running export
+        job["xdata"], job["ydata"] = list(item.xdata), list(item.ydata)
     elif isinstance(item, EquationItem):
         limits = figure_settings.get_limits()
         if item.get_xposition() == 0:
             limits = [limits[0], limits[1]]
         elif item.get_xposition() == 1:
             limits = [limits[2], limits[3]]
-        xdata, ydata = utilities.equation_to_data(item.equation, limits)
-    for values in zip(xdata, ydata):
-        stream.put_string(fmt % values + "\n")
-    stream.close()
+        job["equation"], job["limits"] = item.equation, limits
+    return job
+
+
+def _get_xydata(job: dict) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Get the data of a job as arrays, sampling equations if needed."""
+    if job["equation"] is not None:
+        xdata, ydata = utilities.equation_to_data(
+            job["equation"],
+            job["limits"],
+        )
+    else:
+        xdata, ydata = job["xdata"], job["ydata"]
+    return (
+        numpy.asarray(xdata, dtype=float),
+        numpy.asarray(ydata, dtype=float),
+    )
+
+
+class _ExportTask():
+    """
+    Export jobs concurrently on a pool of worker threads.
+
+    Sampling, formatting and writing all happen in the workers, progress is
+    reported on the main loop through a toast that also allows cancelling
+    the export. Cancelled or failed files are removed again.
+    """
+
+    def __init__(self, window: Graphs.Window, mode: str, jobs: list[dict]):
+        self._window = window
+        self._callback = getattr(sys.modules[__name__], "_save_" + mode)
+        self._jobs = jobs
+        self._finished = 0
+        self._failed = []
+        self._cancellable = Gio.Cancellable()
+        self._executor = ThreadPoolExecutor(
+            max_workers=min(len(jobs), os.cpu_count() or 1),
+        )
+        self._toast = Adw.Toast(
+            title=self._get_progress_string(),
+            button_label=_("Cancel"),
+            timeout=0,
+        )
+        self._toast.connect("button-clicked", self._on_cancel)
+
+    def start(self) -> None:
+        """Submit all jobs to the worker pool."""
+        self._window.add_toast(self._toast)
+        for job in self._jobs:
+            future = self._executor.submit(self._run_job, job)
+            future.add_done_callback(
+                lambda future, job=job:
+                GLib.idle_add(self._on_job_finished, job, future),
+            )
+
+    def _get_progress_string(self) -> str:
+        return _("Exporting Data ({finished}/{total})").format(
+            finished=self._finished,
+            total=len(self._jobs),
+        )
+
+    def _on_cancel(self, _toast) -> None:
+        self._cancellable.cancel()
+
+    def _run_job(self, job: dict) -> None:
+        """Export a single job, runs in a worker thread."""
+        self._cancellable.set_error_if_cancelled()
+        try:
+            self._callback(job, self._cancellable)
+        except Exception:
+            with contextlib.suppress(GLib.GError):
+                job["file"].delete(None)
+            raise
+
+    def _on_job_finished(self, job: dict, future) -> bool:
+        """Handle a finished job on the main loop."""
+        self._finished += 1
+        exception = future.exception()
+        if exception is not None and not self._cancellable.is_cancelled():
+            logging.error(
+                "Could not export %s",
+                job["name"],
+                exc_info=exception,
+            )
+            self._failed.append(job["name"])
+        if self._finished < len(self._jobs):
+            self._toast.set_title(self._get_progress_string())
+            return GLib.SOURCE_REMOVE
+
+        self._executor.shutdown(wait=False)
+        self._toast.dismiss()
+        if self._cancellable.is_cancelled():
+            message = _("Export cancelled")
+        elif self._failed:
+            message = _("Failed to export {names}").format(
+                names=", ".join(self._failed),
+            )
+        else:
+            message = _("Exported Data")
+        self._window.add_toast_string(message)
+        return GLib.SOURCE_REMOVE
+
+
+def _write_columns(
+    stream,
+    job: dict,
+    cancellable: Gio.Cancellable,
+) -> None:
+    """
+    Write job in columns format to a binary stream.
+
+    Rows are formatted in chunks of `_CHUNK_SIZE` with a single format call
+    each, such that the stream receives large writes instead of one write
+    per row. Cancellation is checked in between chunks.
+    """
+    delimiter = "\t"
+    row_format = delimiter.join(["%.12e"] * 2) + "\n"
+    xlabel, ylabel = job["xlabel"], job["ylabel"]
+    if xlabel != "" and ylabel != "":
+        stream.write((xlabel + delimiter + ylabel + "\n").encode())
+    xdata, ydata = _get_xydata(job)
+    data = numpy.column_stack((xdata, ydata))
+    for start in range(0, len(data), _CHUNK_SIZE):
+        cancellable.set_error_if_cancelled()
+        chunk = data[start:start + _CHUNK_SIZE]
+        values = tuple(chunk.ravel().tolist())
+        stream.write(((row_format * len(chunk)) % values).encode())
+
+
+def _save_columns(job: dict, cancellable: Gio.Cancellable) -> None:
+    """Save job in columns format."""
+    with gio_pyio.open(job["file"], "wb") as wrapper:
+        _write_columns(wrapper, job, cancellable)
+
+
+def _save_compressed(job: dict, cancellable: Gio.Cancellable) -> None:
+    """Save job in gzip-compressed columns format."""
+    with gio_pyio.open(job["file"], "wb") as wrapper, \
+            gzip.GzipFile(fileobj=wrapper, mode="wb") as stream:
+        _write_columns(stream, job, cancellable)
+
+
+def _save_numpy(job: dict, cancellable: Gio.Cancellable) -> None:
+    """
+    Save job in binary numpy format.
+
+    The columns are stored as separate arrays `x` and `y` in a npz archive,
+    together with the labels of the item.
+    """
+    xdata, ydata = _get_xydata(job)
+    cancellable.set_error_if_cancelled()
+    with gio_pyio.open(job["file"], "wb") as wrapper:
+        numpy.savez(
+            wrapper,
+            x=xdata,
+            y=ydata,
+            xlabel=numpy.array(job["xlabel"]),
+            ylabel=numpy.array(job["ylabel"]),
+        )
@@ -3,6 +3,14 @@ using Gtk;
 
 namespace Graphs {
     namespace Export {
+        private string get_mode_suffix (string mode) {
+            switch (mode) {
+                case "compressed": return "txt.gz";
+                case "numpy": return "npz";
+                default: return "txt";
+            }
+        }
+
         public void export_items (Window window) {
             var application = window.application as Application;
             Data data = window.data;
@@ -10,6 +18,8 @@ namespace Graphs {
                 window.add_toast_string (_("No data to export"));
                 return;
             }
+            GLib.Settings settings = application.get_settings_child ("export-items");
+            string mode = settings.get_string ("mode");
 
             var dialog = new FileDialog ();
             if (data.get_n_items () > 1) {
@@ -17,7 +27,7 @@ namespace Graphs {
                     try {
                         application.python_helper.export_items (
                             window,
-                            "columns",
+                            mode,
                             dialog.select_folder.end (response),
                             data.get_items ()
                         );
@@ -25,18 +35,25 @@ namespace Graphs {
                 });
             } else {
                 Item item = data.get_item (0) as Item;
-                dialog.set_initial_name (item.name + ".txt");
+                string suffix = get_mode_suffix (mode);
+                dialog.set_initial_name (@"$(item.name).$suffix");
                 dialog.set_filters (Tools.create_file_filters (
                     true,
                     Tools.create_file_filter (
                         C_("file-filter", "Text Files"), "txt"
+                    ),
+                    Tools.create_file_filter (
+                        C_("file-filter", "Compressed Text Files"), "txt.gz"
+                    ),
+                    Tools.create_file_filter (
+                        C_("file-filter", "NumPy Archives"), "npz"
                     )
                 ));
                 dialog.save.begin (window, null, (d, response) => {
                     try {
                         application.python_helper.export_items (
                             window,
-                            "columns",
+                            mode,
                             dialog.save.end (response),
                             data.get_items ()
                         );
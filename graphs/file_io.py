@@ -1,28 +1,127 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Module for file operations."""
+import contextlib
+import gzip
 import json
+import zlib
 from xml.dom import minidom
 
-from gi.repository import Gio
+from gi.repository import GLib, Gio
 
 import gio_pyio
 
+_GZIP_MAGIC = b"\x1f\x8b"
+
 
 def parse_json(file: Gio.File) -> dict:
-    """Parse a json file to a python dict."""
+    """Parse a json file to a python dict, which may be gzip compressed."""
     with gio_pyio.open(file, "rb") as wrapper:
-        return json.load(wrapper)
+        data = wrapper.read()
+    if data[:2] == _GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+
+def parse_json_documents(file: Gio.File) -> tuple[list, bool]:
+    """
+    Parse a file holding consecutive json documents.
+
+    The file may consist of multiple gzip members, as written by
+    `append_json`. A trailing member that was not written completely is
+    ignored, such that an interrupted append does not render the file
+    unreadable. Returns the documents and whether the file was read
+    completely. If not, nothing should be appended to the file anymore.
+    """
+    with gio_pyio.open(file, "rb") as wrapper:
+        data = wrapper.read()
+    complete = True
+    if data[:2] == _GZIP_MAGIC:
+        data, complete = _decompress_members(data)
+    text = data.decode()
+    decoder = json.JSONDecoder()
+    documents = []
+    index = 0
+    while True:
+        # Skip the whitespace separating documents
+        while index < len(text) and text[index].isspace():
+            index += 1
+        if index == len(text):
+            return documents, complete
+        document, index = decoder.raw_decode(text, index)
+        documents.append(document)
+
+
+def _decompress_members(data: bytes) -> tuple[bytes, bool]:
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            chunk = decompressor.decompress(data)
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b"".join(chunks), not data
 
 
-def write_json(file: Gio.File, json_object: dict, pretty_print=True) -> None:
-    """Write a python dict to a python file."""
-    with gio_pyio.open(file, "wt") as wrapper:
-        json.dump(
+def write_json(
+    file: Gio.File,
+    json_object: dict,
+    pretty_print=True,
+    compress=False,
+) -> None:
+    """Write a python dict to a python file, optionally gzip compressed."""
+    if not compress:
+        with gio_pyio.open(file, "wt") as wrapper:
+            json.dump(
+                json_object,
+                wrapper,
+                indent=4 if pretty_print else None,
+                sort_keys=True,
+            )
+        return
+    with gio_pyio.open(file, "wb") as wrapper, \
+            gzip.GzipFile(fileobj=wrapper, mode="wb", compresslevel=1) \
+            as stream:
+        stream.write(json.dumps(
             json_object,
-            wrapper,
             indent=4 if pretty_print else None,
             sort_keys=True,
-        )
+        ).encode())
+
+
+def append_json(file: Gio.File, json_object: dict) -> None:
+    """
+    Append a python dict as a separate json document to a file.
+
+    The document is written as a new gzip member, which is concatenated to
+    the existing data on decompression. See `parse_json_documents`.
+    """
+    with gio_pyio.open(file, "ab") as wrapper, \
+            gzip.GzipFile(fileobj=wrapper, mode="wb", compresslevel=1) \
+            as stream:
+        stream.write(b"\n")
+        stream.write(json.dumps(json_object, sort_keys=True).encode())
+
+
+def write_json_atomic(file: Gio.File, json_object: dict, **kwargs) -> None:
+    """
+    Atomically write a python dict to a file.
+
+    The dict is written to a temporary file next to the target, which is then
+    renamed into place, so the target is never left half-written. Keyword
+    arguments are passed on to `write_json`.
+    """
+    temporary_file = file.get_parent().get_child(f".{file.get_basename()}~")
+    try:
+        write_json(temporary_file, json_object, **kwargs)
+        temporary_file.move(file, Gio.FileCopyFlags.OVERWRITE, None, None)
+    except Exception:
+        with contextlib.suppress(GLib.GError):
+            temporary_file.delete(None)
+        raise
 
 
 def parse_xml(file: Gio.File) -> dict:
@@ -0,0 +1,322 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Module for fitting models to data.
+
+Must not import GTK, neither directly nor through `utilities`, as it is
+imported by the spawned worker processes of batch fits. Equations are
+converted to models by `models` instead.
+"""
+import collections
+import contextlib
+import functools
+import threading
+
+from graphs import models
+
+import numpy
+
+from scipy.optimize import _minpack, curve_fit
+
+# Datasets with more points than this are first fitted on a subsample when
+# coarse-to-fine fitting is enabled
+_SUBSAMPLE_THRESHOLD = 100000
+_SUBSAMPLE_SIZE = 10000
+# Relative tolerances used for the final fit when stopping early
+_EARLY_STOPPING_TOLERANCE = 1e-5
+
+
+class FitCancelledError(Exception):
+    """Raised inside the model when a running fit has been cancelled."""
+
+
+class ModelCache():
+    """
+    Least recently used cache of compiled models.
+
+    Entries are keyed by the processed equation and hold the free variables,
+    the model function and a getter for its jacobian. The function is None
+    for equations that cannot be compiled. Building the symbolic jacobian
+    is expensive, so it is only compiled on the first call of the getter,
+    see `fit_model`.
+    """
+
+    def __init__(self, max_size: int = 32):
+        self._max_size = max_size
+        self._models = collections.OrderedDict()
+
+    def get(self, equation: str) -> dict:
+        """Get the compiled model of a processed equation."""
+        return self._lookup(self._models, equation, self._compile)
+
+    @staticmethod
+    def _compile(equation: str) -> dict:
+        return {
+            "free_variables": models.get_free_variables(equation),
+            "function": models.string_to_function(equation),
+            "get_jacobian": functools.cache(
+                functools.partial(models.string_to_jacobian, equation),
+            ),
+        }
+
+    def _lookup(self, items, key: str, factory: callable):
+        with contextlib.suppress(KeyError):
+            items.move_to_end(key)
+            return items[key]
+        value = items[key] = factory(key)
+        if len(items) > self._max_size:
+            items.popitem(last=False)
+        return value
+
+
+def evaluate_model(
+    function: callable,
+    xdata: numpy.ndarray,
+    param: numpy.ndarray,
+) -> numpy.ndarray:
+    """
+    Evaluate a lambdified model over all x values in a single array call.
+
+    Models that do not depend on x return a scalar, so the result is
+    broadcast to the shape of the x values.
+    """
+    xdata = numpy.asarray(xdata, dtype=float)
+    with numpy.errstate(all="ignore"):
+        ydata = numpy.asarray(function(xdata, *param), dtype=float)
+    return numpy.broadcast_to(ydata, xdata.shape).copy()
+
+
+def fit_model(model: dict, *args, **kwargs) -> dict:
+    """
+    Fit the data to a model of `ModelCache`.
+
+    Meant to be called from a worker, such that the jacobian of the model is
+    compiled there. The remaining arguments are passed on to `fit`.
+    """
+    return fit(model["function"], model["get_jacobian"](), *args, **kwargs)
+
+
+def fit_batch(
+    equation: str,
+    datasets: list[tuple[numpy.ndarray, numpy.ndarray]],
+    p0: list,
+    bounds: tuple,
+    method: str,
+    confidence: int,
+    **kwargs,
+) -> list[dict]:
+    """
+    Fit consecutive datasets to the same equation.
+
+    The equation is compiled only once and every fit is started from the
+    parameters of the previous successful fit. Returns a list with the
+    result of `fit` for every dataset.
+    """
+    function = models.string_to_function(equation)
+    if function is None:
+        return [None] * len(datasets)
+    jacobian = models.string_to_jacobian(equation)
+    results = []
+    for xdata, ydata in datasets:
+        result = fit(
+            function, jacobian, xdata, ydata,
+            p0, bounds, method, confidence, **kwargs,
+        )
+        if result is not None:
+            p0 = result["param"]
+        results.append(result)
+    return results
+
+
+def fit(
+    function: callable,
+    jacobian: callable,
+    xdata: numpy.ndarray,
+    ydata: numpy.ndarray,
+    p0: list,
+    bounds: tuple,
+    method: str,
+    confidence: int,
+    cancel_event: threading.Event = None,
+    coarse_to_fine: bool = False,
+    early_stopping: bool = False,
+) -> dict:
+    """
+    Fit the data to the model.
+
+    Returns a dict with the fitted parameters, the fitted curve and the
+    confidence band, or None if the fit was not successful. If a
+    `cancel_event` is given, `FitCancelledError` is raised as soon as it
+    is set.
+
+    With `coarse_to_fine`, large datasets are first fitted on a stratified
+    subsample, and the result is used as starting point for the fit on the
+    full data. With `early_stopping`, the fit on the full data uses looser
+    convergence tolerances.
+    """
+    xdata = numpy.asarray(xdata, dtype=float)
+    ydata = numpy.asarray(ydata, dtype=float)
+
+    def _check_cancelled(callback):
+        if cancel_event is None:
+            return callback
+
+        def _wrapper(*args):
+            if cancel_event.is_set():
+                raise FitCancelledError
+            return callback(*args)
+        return _wrapper
+
+    fit_kwargs = {
+        "bounds": bounds,
+        "nan_policy": "omit",
+        "method": method,
+        "jac": None if jacobian is None else _check_cancelled(jacobian),
+    }
+    if coarse_to_fine and len(xdata) > _SUBSAMPLE_THRESHOLD:
+        indices = get_stratified_indices(len(xdata), _SUBSAMPLE_SIZE)
+        # If the coarse fit fails, just start from the initial values
+        with contextlib.suppress(
+            ValueError, TypeError, _minpack.error, RuntimeError,
+        ):
+            p0 = curve_fit(
+                _check_cancelled(function),
+                xdata[indices], ydata[indices],
+                p0=p0,
+                **fit_kwargs,
+            )[0]
+    if early_stopping:
+        fit_kwargs["ftol"] = _EARLY_STOPPING_TOLERANCE
+        fit_kwargs["xtol"] = _EARLY_STOPPING_TOLERANCE
+    try:
+        param, param_cov = curve_fit(
+            _check_cancelled(function),
+            xdata, ydata,
+            p0=p0,
+            **fit_kwargs,
+        )
+    except (ValueError, TypeError, _minpack.error, RuntimeError):
+        return None
+    fitted_xdata = numpy.linspace(
+        numpy.nanmin(xdata),
+        numpy.nanmax(xdata),
+        5000,
+    )
+    fitted_ydata = evaluate_model(function, fitted_xdata, param)
+    result = {
+        "param": param,
+        "param_cov": param_cov,
+        "xdata": fitted_xdata,
+        "ydata": fitted_ydata,
+    }
+    result.update(get_confidence(
+        function, jacobian, xdata, ydata, fitted_xdata, fitted_ydata,
+        param, param_cov, confidence,
+    ))
+    return result
+
+
+def get_stratified_indices(length: int, size: int) -> numpy.ndarray:
+    """
+    Get indices of a stratified subsample.
+
+    The index range is divided into `size` strata of equal length, from each
+    of which a single random index is drawn. This keeps the subsample spread
+    over the whole dataset. The random generator is seeded, so repeated fits
+    of the same data use the same subsample.
+    """
+    edges = numpy.linspace(0, length, size + 1).astype(int)
+    offsets = numpy.random.default_rng(0).random(size)
+    return edges[:-1] + (offsets * (edges[1:] - edges[:-1])).astype(int)
+
+
+def get_confidence(
+    function: callable,
+    jacobian: callable,
+    xdata: numpy.ndarray,
+    ydata: numpy.ndarray,
+    fitted_xdata: numpy.ndarray,
+    fitted_ydata: numpy.ndarray,
+    param: numpy.ndarray,
+    param_cov: numpy.ndarray,
+    confidence: int,
+) -> dict:
+    """
+    Obtain the confidence and prediction bands from the fit.
+
+    The bands are given in terms of `confidence` standard deviations, and
+    are obtained by propagating the covariance of the parameters through the
+    jacobian of the model, see `get_band`. The prediction band additionally
+    includes the variance of the residuals. Returns a dict with the sigma, R²
+    and the fill data of both bands, where R² and the fill data are None when
+    they could not be obtained.
+    """
+    # Get standard deviation
+    sigma = numpy.sqrt(numpy.diagonal(param_cov)) * confidence
+    result = {"sigma": sigma, "r2": None, "fill": None, "prediction": None}
+    try:
+        fitted_y = evaluate_model(function, xdata, param)
+    except (OverflowError, ZeroDivisionError):
+        return result
+    residuals = ydata - fitted_y
+    ss_res = numpy.nansum(residuals**2)
+    ss_sum = numpy.nansum((ydata - numpy.nanmean(fitted_y))**2)
+    result["r2"] = 1 - (ss_res / ss_sum)
+    if jacobian is None:
+        return result
+
+    degrees_of_freedom = max(
+        numpy.count_nonzero(numpy.isfinite(residuals)) - len(param),
+        1,
+    )
+    lowest, highest = numpy.nanmin(fitted_ydata), numpy.nanmax(fitted_ydata)
+    middle = (highest + lowest) / 2
+    span = highest - lowest
+    for key, residual_variance in (
+        ("fill", 0),
+        ("prediction", ss_res / degrees_of_freedom),
+    ):
+        band = get_band(
+            jacobian,
+            fitted_xdata,
+            param,
+            param_cov,
+            residual_variance,
+        ) * confidence
+        # Cancel if there's no valid values in the band
+        if not numpy.isfinite(band).any():
+            continue
+        lower, upper = fitted_ydata - band, fitted_ydata + band
+        # Don't try to draw complicated and resource-hogging bounds when
+        # far out of range, instead clip them to values far away. Flat
+        # curves have no span to compare to, so they are left as they are.
+        if span > 0:
+            lower = numpy.clip(lower, middle - 1e5 * span, None)
+            upper = numpy.clip(upper, None, middle + 1e5 * span)
+        result[key] = (fitted_xdata, lower, upper)
+    return result
+
+
+def get_band(
+    jacobian: callable,
+    xdata: numpy.ndarray,
+    param: numpy.ndarray,
+    param_cov: numpy.ndarray,
+    residual_variance: float = 0,
+) -> numpy.ndarray:
+    """
+    Get the standard deviation of the model at every x value.
+
+    The variance at every point is `J C J^T`, with `J` the jacobian row at
+    that point and `C` the covariance of the parameters. This is evaluated
+    for all points in a single batched product. Adding the residual variance
+    turns the confidence band into a prediction band.
+    """
+    with numpy.errstate(all="ignore"):
+        jacobian_matrix = jacobian(xdata, *param)
+        variance = numpy.einsum(
+            "ij,jk,ik->i",
+            jacobian_matrix,
+            param_cov,
+            jacobian_matrix,
+        )
+        return numpy.sqrt(variance + residual_variance)
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Module for keeping history states on disk."""
+import sqlite3
+import threading
+import weakref
+from collections.abc import MutableMapping
+
+
+class SpilledArrays(MutableMapping):
+    """
+    Encoded arrays of history states, stored in a temporary database.
+
+    Behaves like the dict of encoded arrays of a project, see
+    `project.encode_history_state`, but keeps the arrays on disk. The
+    database is private and removed once closed, which happens at the
+    latest when the store is no longer referenced. Access is thread safe, so
+    saves can read from it in the background.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # An empty filename creates a temporary database on disk
+        self._connection = sqlite3.connect(
+            "",
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute(
+            "CREATE TABLE arrays (digest TEXT PRIMARY KEY, data TEXT)",
+        )
+        self._finalizer = weakref.finalize(self, self._connection.close)
+
+    def __getitem__(self, digest: str) -> str:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM arrays WHERE digest = ?", (digest, ),
+            ).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return row[0]
+
+    def __setitem__(self, digest: str, data: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO arrays VALUES (?, ?)", (digest, data),
+            )
+
+    def __delitem__(self, digest: str) -> None:
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM arrays WHERE digest = ?", (digest, ),
+            )
+        if cursor.rowcount == 0:
+            raise KeyError(digest)
+
+    def __contains__(self, digest) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM arrays WHERE digest = ?", (digest, ),
+            ).fetchone() is not None
+
+    def __iter__(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT digest FROM arrays",
+            ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM arrays",
+            ).fetchone()[0]
+
+    def discard(self, digests) -> None:
+        """Remove the arrays with the given hashes, if present."""
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM arrays WHERE digest = ?",
+                [(digest, ) for digest in digests],
+            )
+
+    def close(self) -> None:
+        """Close and remove the database."""
+        with self._lock:
+            self._finalizer()
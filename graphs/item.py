@@ -6,6 +6,8 @@ from gi.repository import GObject, Graphs
 
 from graphs import misc, utilities
 
+import numpy
+
 
 def new_from_dict(dictionary: dict):
     """Instanciate item from dict."""
@@ -85,10 +87,26 @@ class DataItem(_PythonItem):
         )
 
     def __init__(self, **kwargs):
+        self._sorted = None
         super().__init__(typename=_("Dataset"), **kwargs)
         for prop in ("xdata", "ydata"):
             if self.get_property(prop) is None:
                 self.set_property(prop, [])
+        self.connect("notify::xdata", self._on_xdata_changed)
+
+    def _on_xdata_changed(self, _item, _param) -> None:
+        self._sorted = None
+
+    def is_sorted(self) -> bool:
+        """
+        Check if the x values are in ascending order.
+
+        The result is cached until xdata is set again.
+        """
+        if self._sorted is None:
+            xdata = numpy.asarray(self.props.xdata, dtype=float)
+            self._sorted = bool(numpy.all(xdata[:-1] <= xdata[1:]))
+        return self._sorted
 
 
 class EquationItem(_PythonItem):
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Module for converting equations to model functions.
+
+Only depends on numpy and sympy, and must not import GTK, as it is imported
+by the spawned worker processes of batch fits.
+"""
+import contextlib
+import re
+
+import numpy
+
+import sympy
+
+
+def string_to_function(equation_name: str) -> sympy.FunctionClass:
+    """Convert a string into a sympy function."""
+    variables = ["x"] + get_free_variables(equation_name)
+    sym_vars = sympy.symbols(variables)
+    with contextlib.suppress(sympy.SympifyError, TypeError, SyntaxError):
+        symbolic = sympy.sympify(
+            equation_name,
+            locals=dict(zip(variables, sym_vars)),
+        )
+        return sympy.lambdify(sym_vars, symbolic)
+
+
+def string_to_jacobian(equation_name: str) -> callable:
+    """
+    Convert a string into a vectorized jacobian function.
+
+    The partial derivatives towards every free variable are derived
+    symbolically. The returned function takes the same arguments as the
+    function from `string_to_function` and returns a matrix with one row per
+    x value and one column per free variable, as expected by `curve_fit`.
+    Returns None if the derivatives cannot be converted to a function, in
+    which case `curve_fit` falls back to finite differences.
+    """
+    variables = ["x"] + get_free_variables(equation_name)
+    # Real symbols keep derivatives like the one of `abs` in closed form
+    sym_vars = sympy.symbols(variables, real=True)
+    try:
+        symbolic = sympy.sympify(
+            equation_name,
+            locals=dict(zip(variables, sym_vars)),
+        )
+        derivatives = sympy.lambdify(
+            sym_vars,
+            [sympy.diff(symbolic, var) for var in sym_vars[1:]],
+        )
+    except (
+        sympy.SympifyError, TypeError, SyntaxError, ValueError,
+        NotImplementedError,
+    ):
+        return None
+
+    def jacobian(xdata, *args):
+        xdata = numpy.asarray(xdata, dtype=float)
+        with numpy.errstate(all="ignore"):
+            columns = derivatives(xdata, *args)
+        # Derivatives that do not depend on x evaluate to a scalar
+        return numpy.column_stack([
+            numpy.broadcast_to(
+                numpy.asarray(column, dtype=float),
+                xdata.shape,
+            ) for column in columns
+        ])
+
+    return jacobian
+
+
+def get_free_variables(equation_name: str) -> list:
+    """Get the free variables (non-x) from an equation."""
+    pattern = (
+        r"\b(?!x\b|X\b"  # Exclude 'x' and 'X'
+        r"|sec\b|sin\b|cos\b|log\b|tan\b|csc\b|cot\b"  # Exclude trig func.
+        r"|arcsin\b|arccos\b|arctan\b"  # Exclude arctrig func.
+        r"|arccot\b|arcsec\b|arccsc\b"  # Exclude arctrig func.
+        r"|sinh\b|cosh\b|tanh\b"  # Exclude hyperbolicus argtrig func.
+        r"|arcsinh\b|arccosh\b|arctanh\b"  # Exclude hyperb. arctrig func.
+        r"|exp\b|sqrt\b|abs\b|log10\b)"  # Exclude 'exp', 'sqrt', 'abs'
+        r"[a-zA-Z]+\b"  # Match any character sequence that is not excluded
+    )
+    # Keep the order of appearance, so the order is the same in every
+    # process regardless of hash randomization
+    return list(dict.fromkeys(re.findall(pattern, equation_name)))
@@ -9,8 +9,6 @@ from gi.repository import Gio, Graphs
 from graphs import misc, scales, utilities
 from graphs.item import DataItem, EquationItem
 
-import numexpr
-
 import numpy
 
 import scipy
@@ -26,9 +24,9 @@ def perform_operation(application: Graphs.Application, name: str) -> None:
         return
     args = []
     actions_settings = application.get_settings_child("actions")
-    if name in ("center", "smoothen"):
+    if name in ("center", "combine", "resample", "smoothen"):
         args = [actions_settings.get_enum(name)]
-    if name == "smoothen":
+    if name in ("resample", "smoothen"):
         args.append(actions_settings.get_child(name))
     elif "translate" in name or "multiply" in name:
         try:
@@ -45,32 +43,33 @@ def perform_operation(application: Graphs.Application, name: str) -> None:
     figure_settings = data.get_figure_settings()
     old_limits = figure_settings.get_limits()
 
-    if hasattr(CommonOperations, name):
-        all_success = getattr(CommonOperations, name)(window)
-    else:
-        all_success = False
-        for item in data:
-            if not item.get_selected():
-                continue
-            if isinstance(item, EquationItem):
-                operations_class = EquationOperations
-            elif isinstance(item, DataItem):
-                operations_class = DataOperations
-            else:
-                continue
-            success, message = operations_class.execute(
-                item,
-                name,
-                figure_settings,
-                interaction_mode,
-                *args,
-            )
-            if message:
-                window.add_toast_string(message)
-            all_success = success or all_success
-    if all_success:
-        data.optimize_limits()
-        data.add_history_state_with_limits(old_limits)
+    # Changes to all items end up in a single history state
+    with data.transaction(old_limits):
+        if hasattr(CommonOperations, name):
+            all_success = getattr(CommonOperations, name)(window, *args)
+        else:
+            all_success = False
+            for item in data:
+                if not item.get_selected():
+                    continue
+                if isinstance(item, EquationItem):
+                    operations_class = EquationOperations
+                elif isinstance(item, DataItem):
+                    operations_class = DataOperations
+                else:
+                    continue
+                success, message = operations_class.execute(
+                    item,
+                    name,
+                    figure_settings,
+                    interaction_mode,
+                    *args,
+                )
+                if message:
+                    window.add_toast_string(message)
+                all_success = success or all_success
+        if all_success:
+            data.optimize_limits()
 
 
 class DataHelper():
@@ -81,25 +80,20 @@ class DataHelper():
         interaction_mode: int,
         selected_limits: tuple[float, float],
         item: DataItem,
-    ) -> tuple[list[float], list[float]]:
-        """Get the X and Y data of a DataItem."""
-        xdata = item.props.xdata
-        ydata = item.props.ydata
-        if interaction_mode == 2:
-            startx, stopx = selected_limits
-            # If startx and stopx are not out of range, that is,
-            # if the item data is within the highlight
-            xmin = min(xdata)
-            if not (startx < xmin and stopx < xmin or (startx > max(xdata))):
-                xdata, ydata = DataHelper.filter_data(
-                    xdata, ydata, ">=", startx,
-                )
-                xdata, ydata = DataHelper.filter_data(
-                    xdata, ydata, "<=", stopx,
-                )
-            else:
-                xdata = None
-                ydata = None
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Get the X and Y data of a DataItem within the selected range.
+
+        Returns None for both if no data is within the selected range.
+        """
+        xdata = numpy.asarray(item.props.xdata, dtype=float)
+        ydata = numpy.asarray(item.props.ydata, dtype=float)
+        selection = DataHelper.get_selection(
+            interaction_mode, selected_limits, item, xdata,
+        )
+        xdata, ydata = xdata[selection], ydata[selection]
+        if len(xdata) == 0:
+            return None, None
         return xdata, ydata
 
     @staticmethod
@@ -150,72 +144,233 @@ class DataHelper():
         return min_x, max_x
 
     @staticmethod
-    def filter_data(
-        xdata: list,
-        ydata: list,
-        condition: str,
-        value: float,
-    ) -> list:
-        """Filter coordinates based on the given condition."""
-        xdata = numpy.array(xdata)
-        ydata = numpy.array(ydata)
-
-        conditions = {
-            "<=": numpy.less_equal,
-            ">=": numpy.greater_equal,
-            "==": numpy.equal,
-        }
-        mask = conditions[condition](xdata, value)
-
-        xdata_filtered = xdata[mask]
-        ydata_filtered = ydata[mask]
+    def get_selection(
+        interaction_mode: int,
+        selected_limits: tuple[float, float],
+        item: DataItem,
+        xdata: numpy.ndarray,
+    ) -> slice | numpy.ndarray:
+        """
+        Get the data points of an item within the selected range.
 
-        return list(xdata_filtered), list(ydata_filtered)
+        If the x values of the item are sorted, the range is found with two
+        binary searches, and a slice is returned that gives views of the
+        data. Otherwise a boolean mask is returned.
+        """
+        if interaction_mode != 2:
+            return slice(None)
+        startx, stopx = selected_limits
+        if item.is_sorted():
+            return slice(
+                numpy.searchsorted(xdata, startx, side="left"),
+                numpy.searchsorted(xdata, stopx, side="right"),
+            )
+        return (xdata >= startx) & (xdata <= stopx)
 
     @staticmethod
-    def create_data_mask(
-        xdata1: list,
-        ydata1: list,
-        xdata2: list,
-        ydata2: list,
-    ) -> bool:
+    def get_common_grid(
+        datasets: list[tuple[numpy.ndarray, numpy.ndarray]],
+        points: int,
+    ) -> numpy.ndarray | None:
         """
-        Create a mask for matching pairs of coordinates.
+        Get an evenly spaced grid over the x range shared by all datasets.
 
-        Returns:
-        - Boolean mask indicating where pairs of coordinates match.
+        Returns None if the datasets do not overlap.
         """
-        xdata1, ydata1, xdata2, ydata2 = \
-            map(numpy.array, [xdata1, ydata1, xdata2, ydata2])
-        return numpy.any((xdata1[:, None] == xdata2)
-                         & (ydata1[:, None] == ydata2),
-                         axis=1)
+        start = max(numpy.nanmin(xdata) for xdata, _ydata in datasets)
+        stop = min(numpy.nanmax(xdata) for xdata, _ydata in datasets)
+        if start > stop or (start == stop and points > 1):
+            return None
+        return numpy.linspace(start, stop, points)
 
     @staticmethod
-    def sort_data(xdata: list, ydata: list) -> (list, list):
-        """Sort data."""
-        return map(
-            list,
-            zip(
-                *sorted(
-                    zip(xdata, ydata),
-                    key=lambda x_values: x_values[0],
-                ),
-            ),
+    def resample(
+        xdata: numpy.ndarray,
+        ydata: numpy.ndarray,
+        grid: numpy.ndarray,
+        method: int,
+    ) -> numpy.ndarray:
+        """
+        Get the y values of the data at the x values of a grid.
+
+        The data is interpolated linearly or with a cubic spline. For the bin
+        average, every grid point gets the average of the data within the bin
+        around it, which is NaN for bins without any data.
+        """
+        xdata = numpy.asarray(xdata, dtype=float)
+        ydata = numpy.asarray(ydata, dtype=float)
+        valid = numpy.isfinite(xdata) & numpy.isfinite(ydata)
+        xdata, ydata = DataHelper.sort_data(xdata[valid], ydata[valid])
+        if method == 2:  # Bin average
+            middles = (grid[1:] + grid[:-1]) / 2
+            indices = numpy.searchsorted(middles, xdata, side="right")
+            # Points outside of the grid fall into the outer bins, so drop
+            # those that are further away than half a bin
+            if len(grid) > 1:
+                half_bin = (grid[-1] - grid[0]) / (len(grid) - 1) / 2
+                inside = (xdata >= grid[0] - half_bin) \
+                    & (xdata <= grid[-1] + half_bin)
+                indices, ydata = indices[inside], ydata[inside]
+            sums = numpy.bincount(indices, ydata, minlength=len(grid))
+            counts = numpy.bincount(indices, minlength=len(grid))
+            with numpy.errstate(invalid="ignore"):
+                return sums / counts
+        # Interpolation needs strictly increasing x values, values outside
+        # of the range of the data are NaN
+        xdata, ydata = DataHelper.merge_duplicates(xdata, ydata, 1)
+        if method == 1 and len(xdata) > 2:  # Cubic spline
+            return scipy.interpolate.CubicSpline(
+                xdata, ydata, extrapolate=False,
+            )(grid)
+        return numpy.interp(
+            grid, xdata, ydata, left=numpy.nan, right=numpy.nan,
         )
 
     @staticmethod
-    def filter_range(xdata, ydata, prev_xdata, prev_ydata):
-        """Filter range."""
-        if min(xdata) >= min(prev_xdata) and max(xdata) <= max(prev_ydata):
-            new_xdata, new_ydata = DataHelper.filter_data(
-                prev_xdata, prev_ydata, ">=", min(xdata),
-            )
-            new_xdata, new_ydata = DataHelper.filter_data(
-                new_xdata, new_ydata, "<=", max(xdata),
+    def get_references(items: list, expressions: list[str]) -> dict:
+        """
+        Get the data of the items that are referenced in expressions.
+
+        An item is referenced as `y_<name>`, where characters of the name
+        other than letters and digits are replaced by underscores, or by its
+        position in the item list as `y_<n>`, starting at 1. Returns a dict
+        with the x and y data of every referenced item by variable name.
+        """
+        names = set()
+        for expression in expressions:
+            names.update(
+                re.findall(r"\by_(\w+)", utilities.preprocess(expression)),
             )
-            return new_xdata, new_ydata
-        return xdata, ydata
+        names -= {"min", "max"}
+        references = {}
+        for index, item in enumerate(items, 1):
+            if not isinstance(item, DataItem):
+                continue
+            for name in (str(index), re.sub(r"\W", "_", item.get_name())):
+                name = name.lower()
+                if name in names and "y_" + name not in references:
+                    references["y_" + name] = (
+                        numpy.asarray(item.props.xdata, dtype=float),
+                        numpy.asarray(item.props.ydata, dtype=float),
+                    )
+        return references
+
+    @staticmethod
+    def align(
+        reference: tuple[numpy.ndarray, numpy.ndarray],
+        xdata: numpy.ndarray,
+    ) -> numpy.ndarray:
+        """
+        Get the y values of reference data at the given x values.
+
+        Data that shares the x values is used as is, other data is linearly
+        interpolated. Values outside of the range of the reference are NaN.
+        """
+        reference_xdata, reference_ydata = reference
+        if numpy.array_equal(reference_xdata, xdata):
+            return reference_ydata
+        return DataHelper.resample(
+            reference_xdata, reference_ydata, numpy.asarray(xdata), 0,
+        )
+
+    @staticmethod
+    def get_span(ydata: list) -> tuple[float, float] | None:
+        """
+        Get the smallest and largest y value, ignoring zeros.
+
+        Returns None if there are no finite values apart from zero.
+        """
+        if ydata is None:
+            return None
+        ydata = numpy.asarray(ydata, dtype=float)
+        ydata = ydata[numpy.isfinite(ydata) & (ydata != 0)]
+        if len(ydata) == 0:
+            return None
+        return ydata.min(), ydata.max()
+
+    @staticmethod
+    def sort_data(
+        xdata: list,
+        ydata: list,
+    ) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Sort data by the x values.
+
+        A single stable argsort permutation is applied to both arrays. If the
+        x values are already in ascending order, sorting is skipped.
+        """
+        xdata = numpy.asarray(xdata, dtype=float)
+        ydata = numpy.asarray(ydata, dtype=float)
+        if numpy.all(xdata[:-1] <= xdata[1:]):
+            return xdata, ydata
+        order = numpy.argsort(xdata, kind="stable")
+        return xdata[order], ydata[order]
+
+    @staticmethod
+    def merge_sorted(
+        datasets: list[tuple[numpy.ndarray, numpy.ndarray]],
+    ) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Merge datasets that are each sorted by the x values.
+
+        Datasets are merged pairwise, such that every point takes part in
+        only log(k) merges for k datasets. Points with equal x values keep
+        the order of the datasets they come from.
+        """
+        while len(datasets) > 1:
+            merged = [
+                DataHelper._merge_two(*datasets[index:index + 2])
+                for index in range(0, len(datasets) - 1, 2)
+            ]
+            if len(datasets) % 2:
+                merged.append(datasets[-1])
+            datasets = merged
+        return datasets[0]
+
+    @staticmethod
+    def _merge_two(
+        first: tuple[numpy.ndarray, numpy.ndarray],
+        second: tuple[numpy.ndarray, numpy.ndarray],
+    ) -> (numpy.ndarray, numpy.ndarray):
+        # Every point of the second dataset is placed after all points of
+        # the first dataset with lower or equal x values
+        positions = numpy.searchsorted(first[0], second[0], side="right") \
+            + numpy.arange(len(second[0]))
+        from_first = numpy.ones(len(first[0]) + len(second[0]), dtype=bool)
+        from_first[positions] = False
+        merged = []
+        for first_values, second_values in zip(first, second):
+            values = numpy.empty(len(from_first))
+            values[from_first] = first_values
+            values[positions] = second_values
+            merged.append(values)
+        return tuple(merged)
+
+    @staticmethod
+    def merge_duplicates(
+        xdata: numpy.ndarray,
+        ydata: numpy.ndarray,
+        mode: int,
+    ) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Merge points with equal x values in data that is sorted by x.
+
+        Depending on the mode, all points are kept, or the y values of equal
+        x values are replaced by their mean, their sum or the first value.
+        """
+        if mode == 0 or len(xdata) == 0:  # Keep all points
+            return xdata, ydata
+        starts = numpy.flatnonzero(
+            numpy.concatenate(([True], xdata[1:] != xdata[:-1])),
+        )
+        if mode == 1:  # Mean
+            ydata = numpy.add.reduceat(ydata, starts) \
+                / numpy.diff(numpy.append(starts, len(ydata)))
+        elif mode == 2:  # Sum
+            ydata = numpy.add.reduceat(ydata, starts)
+        elif mode == 3:  # Keep first
+            ydata = ydata[starts]
+        return xdata[starts], ydata
 
 
 class CommonOperations():
@@ -230,47 +385,59 @@ class CommonOperations():
             figure_settings = data.get_figure_settings()
             interaction_mode = window.get_canvas().get_mode()
             old_limits = figure_settings.get_limits()
+            # Take the referenced data before any item gets transformed
+            references = DataHelper.get_references(
+                list(data), (input_x, input_y),
+            )
 
-            for item in data:
-                if not item.get_selected():
-                    continue
-                if isinstance(item, EquationItem):
-                    operations_class = EquationOperations
-                elif isinstance(item, DataItem):
-                    operations_class = DataOperations
-                success, message = operations_class.execute(
-                    item,
-                    "transform",
-                    figure_settings,
-                    interaction_mode,
-                    input_x,
-                    input_y,
-                    discard,
-                )
-                if message:
-                    fail_message = _(
-                        "Unable to perform transformation, "
-                        "make sure the syntax is correct")
-                    toast = message if success else fail_message
-                    window.add_toast_string(toast)
-
+            # Changes to all items end up in a single history state
+            with data.transaction(old_limits):
+                for item in data:
+                    if not item.get_selected():
+                        continue
+                    if isinstance(item, EquationItem):
+                        operations_class = EquationOperations
+                    elif isinstance(item, DataItem):
+                        operations_class = DataOperations
+                    else:
+                        continue
+                    success, message = operations_class.execute(
+                        item,
+                        "transform",
+                        figure_settings,
+                        interaction_mode,
+                        input_x,
+                        input_y,
+                        discard,
+                        references,
+                    )
+                    if message:
+                        fail_message = _(
+                            "Unable to perform transformation, "
+                            "make sure the syntax is correct")
+                        toast = message if success else fail_message
+                        window.add_toast_string(toast)
                 data.optimize_limits()
-                data.add_history_state_with_limits(old_limits)
 
         dialog = Graphs.TransformDialog.new(window)
         dialog.connect("accept", on_accept)
         return False
 
     @staticmethod
-    def combine(window: Graphs.Window) -> bool:
-        """Combine the selected data into a new data set."""
+    def combine(window: Graphs.Window, duplicates: int) -> bool:
+        """
+        Combine the selected data into a new data set.
+
+        Every dataset is sorted on its own, after which the datasets are
+        merged. Points with equal x values are handled depending on
+        `duplicates`, see `DataHelper.merge_duplicates`.
+        """
         data = window.get_data()
-        new_xdata, new_ydata = [], []
+        datasets = []
         interaction_mode = window.get_mode()
         for item in data:
             if not item.get_selected():
                 continue
-            xdata, ydata = [], []
             selected_limits = DataHelper.get_selected_limits(
                 data.get_figure_settings(),
                 interaction_mode,
@@ -285,31 +452,97 @@ class CommonOperations():
                 )
             else:
                 continue
-            if xdata is not None and ydata is not None:
-                new_xdata.extend(xdata)
-                new_ydata.extend(ydata)
+            if xdata is not None and len(xdata) != 0:
+                datasets.append(DataHelper.sort_data(xdata, ydata))
 
-        if (not new_xdata) or (not new_ydata):
+        if not datasets:
             window.add_toast_string(
                 _("No data found within the highlighted area"),
             )
             return False
 
         # Create the item itself
-        new_xdata, new_ydata = DataHelper.sort_data(new_xdata, new_ydata)
+        new_xdata, new_ydata = DataHelper.merge_duplicates(
+            *DataHelper.merge_sorted(datasets), duplicates,
+        )
         data.add_items([
             DataItem.new(
                 data.get_selected_style_params(),
-                new_xdata,
-                new_ydata,
+                new_xdata.tolist(),
+                new_ydata.tolist(),
                 name=_("Combined Data"),
             ),
         ])
         return True
 
+    @staticmethod
+    def resample(
+        window: Graphs.Window,
+        method: int,
+        settings: Gio.Settings,
+    ) -> bool:
+        """
+        Resample the selected data onto evenly spaced grids.
+
+        If aligning is enabled, all data is resampled onto a single grid over
+        the range that is shared by all selected data. Otherwise every item
+        gets its own grid over its own range.
+        """
+        data = window.get_data()
+        figure_settings = data.get_figure_settings()
+        interaction_mode = window.get_mode()
+        points = settings.get_int("points")
+        items = [
+            item for item in data
+            if item.get_selected() and isinstance(item, DataItem)
+        ]
+        grid = None
+        if settings.get_boolean("align"):
+            datasets = []
+            for item in items:
+                xdata, ydata = DataHelper.get_xydata(
+                    interaction_mode,
+                    DataHelper.get_selected_limits(
+                        figure_settings, interaction_mode, item,
+                    ),
+                    item,
+                )
+                if xdata is not None:
+                    datasets.append((xdata, ydata))
+            if datasets:
+                grid = DataHelper.get_common_grid(datasets, points)
+            if grid is None:
+                window.add_toast_string(
+                    _("Selected data does not share a common range"),
+                )
+                return False
+
+        all_success = False
+        for item in items:
+            success, message = DataOperations.execute(
+                item,
+                "resample",
+                figure_settings,
+                interaction_mode,
+                method,
+                points,
+                grid,
+            )
+            if message:
+                window.add_toast_string(message)
+            all_success = success or all_success
+        return all_success
+
     @staticmethod
     def shift(window: Graphs.Window) -> None:
-        """Shift data."""
+        """
+        Shift data.
+
+        Items are stacked in order. Every item is shifted by the accumulated
+        spans of the items before it, plus a tenth of the axis range per
+        step. The span of every item is computed once, such that all offsets
+        are obtained in a single pass.
+        """
         interaction_mode = window.get_mode()
         data = window.get_data()
         figure_settings = data.get_figure_settings()
@@ -323,59 +556,43 @@ class CommonOperations():
         ]
         left_scale = scales.Scale(figure_settings.get_left_scale())
         right_scale = scales.Scale(figure_settings.get_right_scale())
-        for index, item in enumerate(data_list):
+        shift_value = 0
+        previous_span = None
+        for item in data_list:
             selected_limits = DataHelper.get_selected_limits(
                 figure_settings,
                 interaction_mode,
                 item,
             )
             scale = right_scale if item.get_yposition() else left_scale
+            y_range = ranges[item.get_yposition() - 1]
             if isinstance(item, EquationItem):
-                xdata, ydata = utilities.equation_to_data(
+                ydata = utilities.equation_to_data(
                     item.props.equation, selected_limits,
-                )
+                )[1]
             elif isinstance(item, DataItem):
-                xdata, ydata = DataHelper().get_xydata(
-                    interaction_mode, selected_limits, item,
+                item_xdata = numpy.asarray(item.props.xdata, dtype=float)
+                # Item data may be shared, so modify a copy
+                item_ydata = numpy.array(item.props.ydata, dtype=float)
+                selection = DataHelper.get_selection(
+                    interaction_mode, selected_limits, item, item_xdata,
                 )
-            if (not xdata) or (not ydata):
+                ydata = item_ydata[selection]
+            span = DataHelper.get_span(ydata)
+            if span is None:
                 continue
-
-            shift_value = 0
-
-            item_ = data_list[0]
-            for i in range(index + 1):
-                previous_item = item_
-                item_ = data_list[i]
-                y_range = ranges[item_.get_yposition() - 1]
-
-                if isinstance(previous_item, EquationItem):
-                    prev_xdata, prev_ydata = utilities.equation_to_data(
-                        previous_item.props.equation, selected_limits,
-                    )
-                else:
-                    prev_xdata, prev_ydata = \
-                        previous_item.props.xdata, previous_item.props.ydata
-
-                new_ydata = DataHelper.filter_range(
-                    xdata,
-                    ydata,
-                    prev_xdata,
-                    prev_ydata,
-                )[1]
-                ymin = min(x for x in new_ydata if x != 0)
-                ymax = max(x for x in new_ydata if x != 0)
-
-                if scale == scales.Scale.LOG:
-                    shift_value += \
-                        numpy.log10(abs(ymax / ymin)) \
-                        + 0.1 * numpy.log10(y_range)
-                elif scale == scales.Scale.LOG2:
-                    shift_value += \
-                        numpy.log2(abs(ymax / ymin)) \
-                        + 0.1 * numpy.log2(y_range)
-                else:
-                    shift_value += (ymax - ymin) + 0.1 * y_range
+            # The first item is shifted by its own span
+            ymin, ymax = span if previous_span is None else previous_span
+            previous_span = span
+
+            if scale == scales.Scale.LOG:
+                shift_value += \
+                    numpy.log10(abs(ymax / ymin)) + 0.1 * numpy.log10(y_range)
+            elif scale == scales.Scale.LOG2:
+                shift_value += \
+                    numpy.log2(abs(ymax / ymin)) + 0.1 * numpy.log2(y_range)
+            else:
+                shift_value += (ymax - ymin) + 0.1 * y_range
             if shift_value == 0:
                 continue
             if isinstance(item, EquationItem):
@@ -387,26 +604,15 @@ class CommonOperations():
                     equation = f"{item.equation}+{shift_value}"
                 equation = utilities.preprocess(equation)
                 item.props.equation = str(sympy.simplify(equation))
-                continue
             elif isinstance(item, DataItem):
+                # Change coordinates that were within span
                 if scale == scales.Scale.LOG:
-                    new_ydata = [value * 10**shift_value for value in ydata]
+                    item_ydata[selection] *= 10**shift_value
                 elif scale == scales.Scale.LOG2:
-                    new_ydata = [value * 2**shift_value for value in ydata]
+                    item_ydata[selection] *= 2**shift_value
                 else:  # Apply linear scaling
-                    new_ydata = [value + shift_value for value in ydata]
-                i = 0
-                for index, masked in enumerate(DataHelper.create_data_mask(
-                    item.props.xdata, item.props.ydata, xdata, ydata,
-                )):
-                    # Change coordinates that were within span
-                    if masked:
-                        item.props.xdata[index] = xdata[i]
-                        item.props.ydata[index] = new_ydata[i]
-                        i += 1
-                item.notify("xdata")
-                item.notify("ydata")
-                continue
+                    item_ydata[selection] += shift_value
+                item.props.ydata = item_ydata.tolist()
         return True
 
 
@@ -550,6 +756,7 @@ class EquationOperations():
         input_x: str,
         input_y: str,
         _discard: bool,
+        _references: dict = None,
     ) -> str:
         """Perform custom transformation."""
         xdata, ydata = utilities.equation_to_data(item._equation, limits)
@@ -591,12 +798,16 @@ class DataOperations():
             interaction_mode,
             item,
         )
-        xdata, ydata = DataHelper.get_xydata(
-            interaction_mode, selected_limits, item,
+        # Item data may be shared, so write back into a copy
+        item_xdata = numpy.array(item.props.xdata, dtype=float)
+        item_ydata = numpy.array(item.props.ydata, dtype=float)
+        selection = DataHelper.get_selection(
+            interaction_mode, selected_limits, item, item_xdata,
         )
+        xdata, ydata = item_xdata[selection], item_ydata[selection]
         try:
             callback = getattr(DataOperations, name)
-            if not (xdata is not None and len(xdata) != 0):
+            if len(xdata) == 0:
                 return False, _("No data found within the highlighted area")
             message = ""
             new_xdata, new_ydata, sort, discard = callback(
@@ -610,44 +821,35 @@ class DataOperations():
                 "{name}: Error performing the operation",
             ).format(name=exception.__class__.__name__)
             return False, message
-        new_xdata, new_ydata = list(new_xdata), list(new_ydata)
+        new_xdata = numpy.asarray(new_xdata, dtype=float)
+        new_ydata = numpy.asarray(new_ydata, dtype=float)
         if discard and interaction_mode == 2:
             logging.debug("Discard is true")
             message = _(
                 "Data that was outside of the highlighted area has"
                 " been discarded",
             )
-            item.props.xdata = new_xdata
-            item.props.ydata = new_ydata
+            item_xdata, item_ydata = new_xdata, new_ydata
         else:
             logging.debug("Discard is false")
-            mask = DataHelper.create_data_mask(
-                item.props.xdata,
-                item.props.ydata,
-                xdata,
-                ydata,
-            )
-            if new_xdata == []:  # If cut action was performed
-                remove_list = \
-                    [index for index, masked in enumerate(mask) if masked]
-                for index in sorted(remove_list, reverse=True):
-                    item.props.xdata.pop(index)
-                    item.props.ydata.pop(index)
+            if len(new_xdata) == len(xdata):
+                # Change coordinates that were within span
+                item_xdata[selection] = new_xdata
+                item_ydata[selection] = new_ydata
             else:
-                i = 0
-                for index, masked in enumerate(mask):
-                    # Change coordinates that were within span
-                    if masked:
-                        item.props.xdata[index] = new_xdata[i]
-                        item.props.ydata[index] = new_ydata[i]
-                        i += 1
+                # Replace the coordinates within span, for instance when a
+                # cut action was performed
+                keep = numpy.ones(len(item_xdata), dtype=bool)
+                keep[selection] = False
+                item_xdata = numpy.concatenate((item_xdata[keep], new_xdata))
+                item_ydata = numpy.concatenate((item_ydata[keep], new_ydata))
         if sort:
             logging.debug("Sorting data")
-            item.props.xdata, item.props.ydata = DataHelper.sort_data(
-                item.props.ydata, item.props.ydata,
+            item_xdata, item_ydata = DataHelper.sort_data(
+                item_xdata, item_ydata,
             )
-        item.notify("xdata")
-        item.notify("ydata")
+        item.props.xdata = item_xdata.tolist()
+        item.props.ydata = item_ydata.tolist()
         return True, message
 
     @staticmethod
@@ -660,7 +862,8 @@ class DataOperations():
         Will show a toast if a ValueError is raised, typically when a user
         entered an invalid number (e.g. comma instead of point separators)
         """
-        return [value + offset for value in xdata], ydata, True, False
+        xdata = numpy.asarray(xdata, dtype=float)
+        return xdata + offset, ydata, True, False
 
     @staticmethod
     def translate_y(_item, xdata: list, ydata: list, offset: float) -> _return:
@@ -672,7 +875,8 @@ class DataOperations():
         Will show a toast if a ValueError is raised, typically when a user
         entered an invalid number (e.g. comma instead of point separators)
         """
-        return xdata, [value + offset for value in ydata], False, False
+        ydata = numpy.asarray(ydata, dtype=float)
+        return xdata, ydata + offset, False, False
 
     @staticmethod
     def multiply_x(
@@ -689,7 +893,8 @@ class DataOperations():
         Will show a toast if a ValueError is raised, typically when a user
         entered an invalid number (e.g. comma instead of point separators)
         """
-        return [value * multiplier for value in xdata], ydata, True, False
+        xdata = numpy.asarray(xdata, dtype=float)
+        return xdata * multiplier, ydata, True, False
 
     @staticmethod
     def multiply_y(
@@ -706,12 +911,14 @@ class DataOperations():
         Will show a toast if a ValueError is raised, typically when a user
         entered an invalid number (e.g. comma instead of point separators)
         """
-        return xdata, [value * multiplier for value in ydata], False, False
+        ydata = numpy.asarray(ydata, dtype=float)
+        return xdata, ydata * multiplier, False, False
 
     @staticmethod
     def normalize(_item, xdata: list, ydata: list) -> _return:
         """Normalize all selected data."""
-        return xdata, [value / max(ydata) for value in ydata], False, False
+        ydata = numpy.asarray(ydata, dtype=float)
+        return xdata, ydata / numpy.nanmax(ydata), False, False
 
     @staticmethod
     def smoothen(
@@ -750,19 +957,39 @@ class DataOperations():
         Depending on the key, will center either on the middle coordinate, or
         on the maximum value of the data
         """
+        xdata = numpy.asarray(xdata, dtype=float)
         if center_maximum == 0:  # Center at maximum Y
-            middle_index = ydata.index(max(ydata))
-            middle_value = xdata[middle_index]
+            middle_value = xdata[numpy.nanargmax(ydata)]
         elif center_maximum == 1:  # Center at middle
-            middle_value = (min(xdata) + max(xdata)) / 2
-        new_xdata = [coordinate - middle_value for coordinate in xdata]
-        return new_xdata, ydata, True, False
+            middle_value = (numpy.nanmin(xdata) + numpy.nanmax(xdata)) / 2
+        return xdata - middle_value, ydata, True, False
 
     @staticmethod
     def cut(_item, _xdata, _ydata) -> _return:
         """Cut selected data over the span that is selected."""
         return [], [], False, False
 
+    @staticmethod
+    def resample(
+        _item,
+        xdata: list,
+        ydata: list,
+        method: int,
+        points: int,
+        grid: numpy.ndarray = None,
+    ) -> _return:
+        """
+        Resample selected data onto an evenly spaced grid.
+
+        If no grid is given, the grid spans the range of the data.
+        """
+        if grid is None:
+            grid = numpy.linspace(
+                numpy.nanmin(xdata), numpy.nanmax(xdata), points,
+            )
+        return grid, DataHelper.resample(xdata, ydata, grid, method), \
+            True, False
+
     @staticmethod
     def derivative(_item, xdata: list, ydata: list) -> _return:
         """Calculate derivative of all selected data."""
@@ -811,8 +1038,15 @@ class DataOperations():
         input_x: str,
         input_y: str,
         discard: bool = False,
+        references: dict = None,
     ) -> _return:
-        """Perform custom transformation."""
+        """
+        Perform custom transformation.
+
+        The y values of other items can be used as given by `references`,
+        see `DataHelper.get_references`. They are aligned to the x values of
+        the data.
+        """
         local_dict = {
             "x": xdata,
             "y": ydata,
@@ -821,17 +1055,14 @@ class DataOperations():
             "y_min": min(ydata),
             "y_max": max(ydata),
         }
-        # Add array of zeros to return values, such that output remains a list
-        # of the correct size, even when a float is given as input.
+        if references is not None:
+            for name, reference in references.items():
+                local_dict[name] = DataHelper.align(reference, xdata)
+        # Output keeps the size of the input, even when a float is given as
+        # input. The expressions are compiled once for all items.
         return (
-            numexpr.evaluate(
-                utilities.preprocess(input_x) + "+ 0*x",
-                local_dict,
-            ),
-            numexpr.evaluate(
-                utilities.preprocess(input_y) + "+ 0*y",
-                local_dict,
-            ),
+            utilities.evaluate(input_x, local_dict, "x"),
+            utilities.evaluate(input_y, local_dict, "y"),
             True,
             discard,
         )
@@ -1,12 +1,31 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Module for saving and loading projects."""
+import base64
+import collections
+import json
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from gettext import gettext as _
 
-from gi.repository import Gio
+from gi.repository import GLib, Gio
 
-from graphs import file_io, migrate
+from graphs import arrays, file_io, migrate
 
-CURRENT_PROJECT_VERSION = 2
+import numpy
+
+CURRENT_PROJECT_VERSION = 3
+
+# A single worker, such that saves are written in order
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+# Hashes of the arrays stored in project files by uri. Only files in here
+# accept updates, files of which a write failed are removed again.
+_SAVED_ARRAYS = {}
+
+# Lists of floats of at least this length are stored as separate arrays
+_ARRAY_MIN_LENGTH = 16
+_ARRAY_KEY = "__array__"
+_ARRAY_REFERENCE = re.compile(r'\{"__array__": "([0-9a-f]+)"\}')
 
 
 class ProjectParseError(Exception):
@@ -63,14 +82,24 @@ class ProjectMigrator:
             return self._project_dict
 
         # Migrate a project one version at a time
-        for version in range(CURRENT_PROJECT_VERSION - project_version):
-            getattr(self, f"_migrate_v{version + 2}")()
+        for version in range(project_version, CURRENT_PROJECT_VERSION):
+            getattr(self, f"_migrate_v{version + 1}")()
         return self._project_dict
 
     def _migrate_v2(self):
         # Migrate v1 to v2
         self._migrate_inserted_scale(2)  # log2 scale added
 
+    def _migrate_v3(self):
+        # Migrate v2 to v3
+        # History states are stored as json strings, with their arrays
+        # stored separately by content hash. Updates may be appended.
+        stored_arrays = self._project_dict.setdefault("history-arrays", {})
+        self._project_dict["history-states"] = [
+            encode_history_state(state, stored_arrays)
+            for state in self._project_dict["history-states"]
+        ]
+
     def _migrate_inserted_scale(self, scale_index):
         """Handle a new scale being inserted at scale_index."""
         figure_settings = self._project_dict["figure-settings"]
@@ -94,16 +123,225 @@ class ProjectMigrator:
                             change_index][1][i] = val + 1
 
 
+def encode_history_state(state, stored_arrays: dict) -> str:
+    """
+    Encode a history state to a json string.
+
+    Lists of floats, such as the data of items, are replaced by a reference
+    to their content hash, and are stored in `stored_arrays` instead.
+    Identical arrays, like the new data of one state and the old data of the
+    next, are thereby only stored once. Interned arrays are always stored
+    separately, as their hash is already known.
+    """
+    def _encode(value):
+        if isinstance(value, (list, tuple)):
+            if isinstance(value, arrays.FrozenArray) \
+                    or len(value) >= _ARRAY_MIN_LENGTH \
+                    and all(type(item) is float for item in value):
+                return {_ARRAY_KEY: _store_array(value, stored_arrays)}
+            return [_encode(item) for item in value]
+        if isinstance(value, dict):
+            return {key: _encode(item) for key, item in value.items()}
+        return value
+    return json.dumps(_encode(state))
+
+
+def decode_history_state(state: str, stored_arrays: dict):
+    """
+    Decode a history state, see `encode_history_state`.
+
+    Arrays are interned, so they are shared with identical data in memory.
+    """
+    def _object_hook(value: dict):
+        if len(value) == 1 and _ARRAY_KEY in value:
+            return arrays.intern(_load_array(stored_arrays[value[_ARRAY_KEY]]))
+        return value
+    return json.loads(state, object_hook=_object_hook)
+
+
+def get_array_references(state: str) -> list[str]:
+    """Get the hashes of the arrays referenced by an encoded history state."""
+    return _ARRAY_REFERENCE.findall(state)
+
+
+def _store_array(values: list, stored_arrays: dict) -> str:
+    """
+    Store an array by its content hash and return the hash.
+
+    The array is stored as base64 encoded binary, which is compressed if
+    that saves space.
+    """
+    digest = arrays.get_digest(values)
+    if digest not in stored_arrays:
+        data = numpy.asarray(values, dtype="<f8").tobytes()
+        compressed = zlib.compress(data, 1)
+        if len(compressed) < len(data):
+            encoded = "zlib:" + base64.b64encode(compressed).decode()
+        else:
+            encoded = "raw:" + base64.b64encode(data).decode()
+        stored_arrays[digest] = encoded
+    return digest
+
+
+def _load_array(array: str) -> list:
+    encoding, data = array.split(":", 1)
+    data = base64.b64decode(data)
+    if encoding == "zlib":
+        data = zlib.decompress(data)
+    return numpy.frombuffer(data, dtype="<f8").tolist()
+
+
 def read_project_file(file: Gio.File) -> dict:
-    """Read a project dict from file and account for migration."""
+    """
+    Read a project dict from file and account for migration.
+
+    Updates that were appended to the file are merged into the project
+    dict. The amount of updates is stored as `project-updates`, which is None
+    if the file is of an older version, or ends in an update that was not
+    written completely. Updates can't be appended to such files, so they are
+    saved in full again instead.
+    """
     try:
-        project_dict = file_io.parse_json(file)
+        documents, complete = file_io.parse_json_documents(file)
     except UnicodeDecodeError:
-        project_dict = migrate.migrate_project(file)
+        documents, complete = [migrate.migrate_project(file)], True
+    if not documents:
+        raise ProjectParseError(_("Project file is missing data"))
+    project_dict = documents[0]
+    for project_update in documents[1:]:
+        _merge_project_update(project_dict, project_update)
+    _SAVED_ARRAYS.pop(file.get_uri(), None)
+    if complete \
+            and project_dict.get("project-version") == CURRENT_PROJECT_VERSION:
+        project_dict["project-updates"] = len(documents) - 1
+        _SAVED_ARRAYS[file.get_uri()] = set(project_dict["history-arrays"])
+    else:
+        project_dict["project-updates"] = None
     return ProjectMigrator(project_dict).migrate()
 
 
-def save_project_dict(file: Gio.File, project_dict: dict) -> None:
-    """Save a project dict to a file."""
+def _merge_project_update(project_dict: dict, project_update: dict) -> None:
+    """
+    Merge an appended update into a project dict.
+
+    Unchanged items are referenced by their uuid in the update. Of the
+    history states, the first `history-dropped` are removed, after which only
+    `history-kept` states are kept before the new states are appended. The
+    arrays referenced by the new states are added to the stored arrays.
+    """
+    items = {item["uuid"]: item for item in project_dict["data"]}
+    project_dict["data"] = [
+        items[item] if isinstance(item, str) else item
+        for item in project_update.pop("data")
+    ]
+    project_dict.setdefault("history-arrays", {}).update(
+        project_update.pop("history-arrays", {}),
+    )
+    history_states = project_dict["history-states"]
+    start = project_update.pop("history-dropped")
+    end = start + project_update.pop("history-kept")
+    project_update["history-states"] = \
+        history_states[start:end] + project_update["history-states"]
+    project_dict.update(project_update)
+
+
+def save_project_dict(
+    file: Gio.File,
+    project_dict: dict,
+    callback: callable = None,
+) -> None:
+    """
+    Save a project dict to a file in the background.
+
+    The project dict should be a snapshot that is not modified afterwards.
+    Encoding, compression and writing happen on a worker thread, and the file
+    is replaced atomically. Saves are performed in the order they were
+    requested. Once done, `callback` is called on the main loop with the
+    exception that occurred, or None on success.
+
+    Every history state is stored as a separate json string, see
+    `encode_history_state`. The project file can then be parsed without
+    building the history, and only states that are actually used need to be
+    decoded. States that were never decoded are written back as they are.
+    Only arrays that are referenced by a history state are stored.
+    """
+    _submit(_write_project_dict, file, project_dict, callback)
+
+
+def save_project_update(
+    file: Gio.File,
+    project_update: dict,
+    callback: callable = None,
+) -> None:
+    """
+    Append an update to a saved project in the background.
+
+    The update holds the keys of a project dict, except that items which did
+    not change since the last save are given by their uuid, and only new
+    history states are included. See `_merge_project_update`. Arrays that
+    are already stored in the file are not written again. If writing to the
+    file failed previously, the update is refused, and the project should be
+    saved in full instead.
+    """
+    _submit(_write_project_update, file, project_update, callback)
+
+
+def _submit(function, file: Gio.File, project_dict: dict, callback) -> None:
+    future = _SAVE_EXECUTOR.submit(function, file, project_dict)
+    if callback is not None:
+        future.add_done_callback(
+            lambda future: GLib.idle_add(callback, future.exception()),
+        )
+
+
+def _encode_history_states(project_dict: dict) -> set:
+    """
+    Encode history states in place, returns all referenced hashes.
+
+    The stored arrays of the project dict are shared with the history, so
+    new arrays are collected separately.
+    """
+    stored_arrays = project_dict["history-arrays"] = collections.ChainMap(
+        {},
+        project_dict["history-arrays"],
+    )
+    references = set()
+    states = []
+    for state in project_dict["history-states"]:
+        if not isinstance(state, str):
+            state = encode_history_state(state, stored_arrays)
+        references.update(get_array_references(state))
+        states.append(state)
+    project_dict["history-states"] = states
+    return references
+
+
+def _write_project_dict(file: Gio.File, project_dict: dict) -> None:
     project_dict["project-version"] = CURRENT_PROJECT_VERSION
-    file_io.write_json(file, project_dict, pretty_print=False)
+    references = _encode_history_states(project_dict)
+    stored_arrays = project_dict["history-arrays"]
+    project_dict["history-arrays"] = {
+        digest: stored_arrays[digest] for digest in references
+    }
+    _SAVED_ARRAYS.pop(file.get_uri(), None)
+    file_io.write_json_atomic(
+        file,
+        project_dict,
+        pretty_print=False,
+        compress=True,
+    )
+    _SAVED_ARRAYS[file.get_uri()] = references
+
+
+def _write_project_update(file: Gio.File, project_update: dict) -> None:
+    saved_arrays = _SAVED_ARRAYS.pop(file.get_uri(), None)
+    if saved_arrays is None:
+        raise RuntimeError("Previous write to project file failed")
+    references = _encode_history_states(project_update)
+    stored_arrays = project_update["history-arrays"]
+    project_update["history-arrays"] = {
+        digest: stored_arrays[digest]
+        for digest in references - saved_arrays
+    }
+    file_io.append_json(file, project_update)
+    _SAVED_ARRAYS[file.get_uri()] = saved_arrays | references
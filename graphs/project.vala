@@ -18,9 +18,6 @@ namespace Graphs {
 
         private void _save (Window window) {
             window.data.save ();
-            window.add_toast_string_with_file (
-                _("Saved Project"), window.data.file
-            );
         }
 
         private ListModel get_project_file_filters () {
@@ -89,8 +89,7 @@ class PythonHelper(Graphs.PythonHelper):
         items: list[Graphs.Item],
         _n_items: int,
     ) -> None:
-        figure_settings = window.get_data().get_figure_settings()
-        return export_items.export_items(mode, file, items, figure_settings)
+        return export_items.export_items(window, mode, file, items)
 
     @staticmethod
     def _on_add_equation_request(
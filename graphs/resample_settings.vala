@@ -0,0 +1,33 @@
+// SPDX-License-Identifier: GPL-3.0-or-later
+using Adw;
+using Gtk;
+
+namespace Graphs {
+    /**
+     * Resample settings dialog
+     */
+    [GtkTemplate (ui = "/se/sjoerd/Graphs/ui/resample-settings.ui")]
+    public class ResampleDialog : Adw.Dialog {
+        [GtkChild]
+        public unowned Adw.SpinRow points { get; }
+
+        [GtkChild]
+        public unowned Adw.SwitchRow align { get; }
+
+        private Application application { get; set; }
+
+        public ResampleDialog (Window window) {
+            Object ();
+            this.application = window.application as Application;
+            Tools.bind_settings_to_widgets (
+                application.get_settings_child ("actions/resample"), this
+            );
+            present (window);
+        }
+
+        [GtkCallback]
+        private void on_reset () {
+            Tools.reset_settings (application.get_settings_child ("actions/resample"));
+        }
+    }
+}
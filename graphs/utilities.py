@@ -1,7 +1,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Various utility functions."""
 import ast
-import contextlib
+import functools
 import operator as op
 import re
 
@@ -12,8 +12,6 @@ import numexpr
 
 import numpy
 
-import sympy
-
 
 def sig_fig_round(number: float, digits: int) -> float:
     """Round a number to the specified number of significant digits."""
@@ -265,6 +263,37 @@ def preprocess(string: str) -> str:
     return string.lower()
 
 
+@functools.lru_cache(maxsize=64)
+def compile_expression(expression: str, shape_of: str = None):
+    """
+    Preprocess and compile an expression for numexpr.
+
+    If `shape_of` is given, the result always has the shape of that
+    variable, also when the expression is constant. Compiled expressions
+    are cached, and can be shared between threads.
+    """
+    expression = preprocess(expression)
+    if shape_of is not None:
+        expression += f" + 0*{shape_of}"
+    return numexpr.NumExpr(expression)
+
+
+def evaluate(
+    expression: str,
+    local_dict: dict,
+    shape_of: str = None,
+) -> numpy.ndarray:
+    """
+    Evaluate an expression with the variables of `local_dict`.
+
+    The expression is only preprocessed and compiled on first use, see
+    `compile_expression`. Large arrays are evaluated on the thread pool of
+    numexpr. Raises KeyError if the expression uses an unknown variable.
+    """
+    compiled = compile_expression(expression, shape_of)
+    return compiled(*[local_dict[name] for name in compiled.input_names])
+
+
 def equation_to_data(
     equation: str,
     limits: tuple = None,
@@ -273,16 +302,13 @@ def equation_to_data(
     """Convert an equation into data over a specified range of x-values."""
     if limits is None:
         limits = (0, 10)
-    equation = preprocess(equation)
     x_start, x_stop = limits
-    xdata = numpy.ndarray.tolist(numpy.linspace(x_start, x_stop, steps))
+    xdata = numpy.linspace(x_start, x_stop, steps)
     try:
-        ydata = numpy.ndarray.tolist(
-            numexpr.evaluate(equation + " + x*0", local_dict={"x": xdata}),
-        )
+        ydata = evaluate(equation, {"x": xdata}, "x")
     except (KeyError, SyntaxError, ValueError, TypeError):
         return None, None
-    return xdata, ydata
+    return xdata.tolist(), ydata.tolist()
 
 
 def validate_equation(equation: str, limits: tuple = None) -> bool:
@@ -290,30 +316,3 @@ def validate_equation(equation: str, limits: tuple = None) -> bool:
     equation = preprocess(equation)
     validate, _ = equation_to_data(equation, limits, steps=10)
     return (validate is not None)
-
-
-def string_to_function(equation_name: str) -> sympy.FunctionClass:
-    """Convert a string into a sympy function."""
-    variables = ["x"] + get_free_variables(equation_name)
-    sym_vars = sympy.symbols(variables)
-    with contextlib.suppress(sympy.SympifyError, TypeError, SyntaxError):
-        symbolic = sympy.sympify(
-            equation_name,
-            locals=dict(zip(variables, sym_vars)),
-        )
-        return sympy.lambdify(sym_vars, symbolic)
-
-
-def get_free_variables(equation_name: str) -> list:
-    """Get the free variables (non-x) from an equation."""
-    pattern = (
-        r"\b(?!x\b|X\b"  # Exclude 'x' and 'X'
-        r"|sec\b|sin\b|cos\b|log\b|tan\b|csc\b|cot\b"  # Exclude trig func.
-        r"|arcsin\b|arccos\b|arctan\b"  # Exclude arctrig func.
-        r"|arccot\b|arcsec\b|arccsc\b"  # Exclude arctrig func.
-        r"|sinh\b|cosh\b|tanh\b"  # Exclude hyperbolicus argtrig func.
-        r"|arcsinh\b|arccosh\b|arctanh\b"  # Exclude hyperb. arctrig func.
-        r"|exp\b|sqrt\b|abs\b|log10\b)"  # Exclude 'exp', 'sqrt', 'abs'
-        r"[a-zA-Z]+\b"  # Match any character sequence that is not excluded
-    )
-    return list(set(re.findall(pattern, equation_name)))
@@ -45,6 +45,9 @@ namespace Graphs {
         [GtkChild]
         private unowned Adw.SplitButton smoothen_button { get; }
 
+        [GtkChild]
+        private unowned Adw.SplitButton resample_button { get; }
+
         [GtkChild]
         protected unowned Button cut_button { get; }
 
@@ -157,8 +160,20 @@ namespace Graphs {
 
             data.bind_property ("items_selected", shift_button, "sensitive", 2);
             data.bind_property ("data_items_selected", smoothen_button, "sensitive", 2);
+            data.bind_property ("data_items_selected", resample_button, "sensitive", 2);
             data.bind_property ("can_undo", undo_button, "sensitive", 2);
             data.bind_property ("can_redo", redo_button, "sensitive", 2);
+            data.bind_property ("history_size", undo_button, "tooltip-text", 2, (b, from, ref to) => {
+                to.set_string (_("Undo (History uses %s)").printf (format_size (from.get_uint64 ())));
+                return true;
+            });
+            data.saved.connect ((file, success) => {
+                if (success) {
+                    add_toast_string_with_file (_("Saved Project"), file);
+                } else {
+                    add_toast_string (_("Failed to save project"));
+                }
+            });
             data.bind_property ("can_view_back", view_back_button, "sensitive", 2);
             data.bind_property ("can_view_forward", view_forward_button, "sensitive", 2);
 
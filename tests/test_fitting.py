@@ -0,0 +1,177 @@
+"""Tests for fitting."""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from graphs import fitting, models
+
+import numpy
+
+import pytest
+
+XDATA = numpy.linspace(-5, 5, 101)
+BOUNDS = ([-numpy.inf, -numpy.inf], [numpy.inf, numpy.inf])
+
+
+@pytest.mark.parametrize("method", ["lm", "trf"])
+def test_fit_abs(method):
+    """Test if models using abs are fitted with a symbolic jacobian."""
+    equation = "a*abs(x-b)"
+    ydata = 2 * numpy.abs(XDATA - 0.55)
+    jacobian = models.string_to_jacobian(equation)
+    assert jacobian is not None
+    result = fitting.fit(
+        models.string_to_function(equation), jacobian, XDATA, ydata,
+        [1, 0], BOUNDS, method, 1,
+    )
+    assert result is not None
+    assert numpy.allclose(result["param"], [2, 0.55])
+
+
+def test_fit_batch_abs():
+    """Test if batches of models using abs are fitted."""
+    datasets = [(XDATA, a * numpy.abs(XDATA - 0.55)) for a in (2, 3)]
+    results = fitting.fit_batch(
+        "a*abs(x-b)", datasets, [1, 0], BOUNDS, "trf", 1,
+    )
+    assert numpy.allclose(results[0]["param"], [2, 0.55])
+    assert numpy.allclose(results[1]["param"], [3, 0.55])
+
+
+def test_fit_without_jacobian():
+    """Test if models without a jacobian are fitted by finite differences."""
+    result = fitting.fit(
+        models.string_to_function("a*abs(x-b)"), None,
+        XDATA, 2 * numpy.abs(XDATA - 0.55),
+        [1, 0], BOUNDS, "lm", 1,
+    )
+    assert numpy.allclose(result["param"], [2, 0.55])
+    # The bands can't be obtained, but the fit itself is complete
+    assert result["fill"] is None
+    assert result["prediction"] is None
+    assert result["r2"] == pytest.approx(1)
+
+
+def test_confidence_flat_model():
+    """Test if the bands of a constant model enclose the fitted curve."""
+    ydata = 5 + 0.01 * numpy.sin(XDATA)
+    result = fitting.fit(
+        models.string_to_function("a"), models.string_to_jacobian("a"),
+        XDATA, ydata, [1], ([-numpy.inf], [numpy.inf]), "lm", 1,
+    )
+    for key in ("fill", "prediction"):
+        _xdata, lower, upper = result[key]
+        assert numpy.all(lower < result["ydata"])
+        assert numpy.all(upper > result["ydata"])
+
+
+def test_confidence_large_offset():
+    """Test if the bands of a curve far from zero enclose the curve."""
+    equation = "a*x+b"
+    xdata = numpy.linspace(0, 10, 101)
+    ydata = 1e6 + xdata + 0.01 * numpy.sin(7 * xdata)
+    result = fitting.fit(
+        models.string_to_function(equation),
+        models.string_to_jacobian(equation),
+        xdata, ydata, [1, 0], BOUNDS, "lm", 1,
+    )
+    assert numpy.allclose(result["param"], [1, 1e6], rtol=1e-3)
+    for key in ("fill", "prediction"):
+        _xdata, lower, upper = result[key]
+        assert numpy.all(lower < result["ydata"])
+        assert numpy.all(upper > result["ydata"])
+
+
+def test_fit_model():
+    """Test if the jacobian of a cached model is compiled once."""
+    model = fitting.ModelCache().get("a*x+b")
+    result = fitting.fit_model(
+        model, XDATA, 3 * XDATA - 2, [1, 0], BOUNDS, "lm", 1,
+    )
+    assert numpy.allclose(result["param"], [3, -2])
+    assert model["get_jacobian"]() is model["get_jacobian"]()
+
+
+def test_model_cache_invalid():
+    """Test if equations that can't be compiled have no function."""
+    model = fitting.ModelCache().get("a*(x")
+    assert model["function"] is None
+    results = fitting.fit_batch(
+        "a*(x", [(XDATA, XDATA)] * 2,
+        [1], ([-numpy.inf], [numpy.inf]), "lm", 1,
+    )
+    assert results == [None, None]
+
+
+def test_fit_cancelled():
+    """Test if a cancelled fit raises FitCancelledError."""
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(fitting.FitCancelledError):
+        fitting.fit_model(
+            fitting.ModelCache().get("a*x+b"), XDATA, XDATA,
+            [1, 0], BOUNDS, "lm", 1, cancel_event,
+        )
+
+
+def test_fit_batch():
+    """Test if batches are fitted in a spawned worker process."""
+    datasets = [(XDATA, a * XDATA + 1) for a in (2, 3, 4)]
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        results = executor.submit(
+            fitting.fit_batch, "a*x+b", datasets, [1, 0], BOUNDS, "trf", 1,
+        ).result()
+    for a, result in zip((2, 3, 4), results):
+        assert numpy.allclose(result["param"], [a, 1])
+
+
+@pytest.mark.parametrize("early_stopping", [False, True])
+def test_fit_coarse_to_fine(early_stopping):
+    """Test if large datasets are fitted from a subsample first."""
+    xdata = numpy.linspace(0, 10, fitting._SUBSAMPLE_THRESHOLD + 1)
+    ydata = 2 * numpy.exp(-0.5 * xdata) + 1
+    result = fitting.fit_model(
+        fitting.ModelCache().get("a*exp(-b*x)+c"), xdata, ydata,
+        [1, 1, 0], ([-numpy.inf] * 3, [numpy.inf] * 3), "trf", 1,
+        coarse_to_fine=True, early_stopping=early_stopping,
+    )
+    assert numpy.allclose(result["param"], [2, 0.5, 1], rtol=1e-3)
+
+
+def test_get_stratified_indices():
+    """Test if stratified indices are sorted, unique and in range."""
+    indices = fitting.get_stratified_indices(1000, 100)
+    assert len(indices) == 100
+    assert numpy.all(numpy.diff(indices) > 0)
+    assert indices[0] >= 0 and indices[-1] < 1000
+    assert numpy.array_equal(
+        indices, fitting.get_stratified_indices(1000, 100),
+    )
+
+
+@pytest.mark.parametrize("confidence", [1, 2])
+def test_confidence_band(confidence):
+    """Test if the confidence band matches the parameter covariance."""
+    ydata = 3 * XDATA + 1 + 0.1 * numpy.sin(5 * XDATA)
+    result = fitting.fit_model(
+        fitting.ModelCache().get("a*x+b"), XDATA, ydata,
+        [1, 0], BOUNDS, "lm", confidence,
+    )
+    param_cov = result["param_cov"]
+    xdata, lower, upper = result["fill"]
+    # The variance of a linear model is var(a) x² + 2 cov(a, b) x + var(b)
+    expected = confidence * numpy.sqrt(
+        param_cov[0, 0] * xdata**2 + 2 * param_cov[0, 1] * xdata
+        + param_cov[1, 1],
+    )
+    assert numpy.allclose(upper - result["ydata"], expected)
+    assert numpy.allclose(result["ydata"] - lower, expected)
+    assert numpy.allclose(
+        result["sigma"], confidence * numpy.sqrt(numpy.diagonal(param_cov)),
+    )
+    # The prediction band also includes the spread of the residuals
+    _xdata, lower, upper = result["prediction"]
+    assert numpy.all(upper - result["ydata"] > expected)
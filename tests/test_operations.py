@@ -1,7 +1,12 @@
 """Tests for operations."""
+from types import SimpleNamespace
+
+from graphs import utilities
 from graphs.operations import DataHelper
 from graphs.operations import DataOperations
 
+import numpy
+
 import pytest
 
 XDATA = [0, 1, 4, 5, 7, 8, 12, 1]
@@ -19,6 +24,127 @@ def test_sort_data():
     assert is_sorted(sorted_x)
 
 
+def test_sort_data_keeps_pairs():
+    """Test if sort_data function keeps x and y values paired."""
+    sorted_x, sorted_y = DataHelper.sort_data(XDATA, YDATA)
+    assert sorted(zip(XDATA, YDATA)) == sorted(zip(sorted_x, sorted_y))
+    assert list(sorted_y) == [5, 2, 156, 7, 1, 31, 5, 123]
+
+
+def test_sort_data_sorted():
+    """Test if sort_data function leaves sorted data untouched."""
+    xdata = [0, 1, 1, 2, 3]
+    ydata = [4, 3, 2, 1, 0]
+    sorted_x, sorted_y = DataHelper.sort_data(xdata, ydata)
+    assert list(sorted_x) == xdata
+    assert list(sorted_y) == ydata
+
+
+def test_merge_sorted():
+    """Test if merge_sorted function merges sorted datasets in order."""
+    datasets = [
+        (numpy.array([0, 2, 4]), numpy.array([1, 2, 3])),
+        (numpy.array([1, 2]), numpy.array([4, 5])),
+        (numpy.array([-1, 5]), numpy.array([6, 7])),
+    ]
+    xdata, ydata = DataHelper.merge_sorted(datasets)
+    assert list(xdata) == [-1, 0, 1, 2, 2, 4, 5]
+    assert list(ydata) == [6, 1, 4, 2, 5, 3, 7]
+
+
+@pytest.mark.parametrize("mode, expected_y", [
+    (0, [1, 2, 3, 4, 5]),
+    (1, [1, 3, 5]),
+    (2, [1, 9, 5]),
+    (3, [1, 2, 5]),
+])
+def test_merge_duplicates(mode, expected_y):
+    """Test if merge_duplicates function handles equal x values."""
+    xdata = numpy.array([0, 1, 1, 1, 2])
+    ydata = numpy.array([1, 2, 3, 4, 5], dtype=float)
+    new_xdata, new_ydata = DataHelper.merge_duplicates(xdata, ydata, mode)
+    assert list(new_ydata) == expected_y
+    if mode != 0:
+        assert list(new_xdata) == [0, 1, 2]
+
+
+def test_get_common_grid():
+    """Test if get_common_grid function spans the shared range."""
+    datasets = [
+        (numpy.array([0, 1, 2, 3]), numpy.zeros(4)),
+        (numpy.array([1.5, 4]), numpy.zeros(2)),
+    ]
+    grid = DataHelper.get_common_grid(datasets, 4)
+    assert list(grid) == [1.5, 2, 2.5, 3]
+    datasets.append((numpy.array([5, 6]), numpy.zeros(2)))
+    assert DataHelper.get_common_grid(datasets, 4) is None
+
+
+@pytest.mark.parametrize("method, expected_y", [
+    (0, [0, 2.25, 9]),
+    (1, [0, 2.25, 9]),
+    (2, [0, 7.25 / 3, 9]),
+])
+def test_resample(method, expected_y):
+    """Test if resample function evaluates the data on the grid."""
+    xdata = [3, 0, 1, 2, 1.5]
+    ydata = [9, 0, 1, 4, 2.25]
+    grid = numpy.array([0, 1.5, 3])
+    resampled = DataHelper.resample(xdata, ydata, grid, method)
+    assert resampled == pytest.approx(expected_y)
+
+
+def test_transform_references():
+    """Test if transform function aligns referenced data."""
+    xdata = numpy.array([0, 1, 2])
+    ydata = numpy.array([5, 6, 7])
+    references = {
+        "y_bg": (numpy.array([0, 2, 4]), numpy.array([0, 2, 4])),
+        "y_2": (xdata, numpy.array([1, 1, 1])),
+    }
+    new_xdata, new_ydata, _sort, _discard = DataOperations.transform(
+        None, xdata, ydata, "x", "y - y_bg - y_2", references=references,
+    )
+    assert list(new_ydata) == [4, 4, 4]
+
+
+def test_transform_compiles_once():
+    """Test if transform function reuses compiled expressions."""
+    utilities.compile_expression.cache_clear()
+    for offset in range(3):
+        xdata = numpy.arange(4) + offset
+        new_xdata, new_ydata, _sort, _discard = DataOperations.transform(
+            None, xdata, xdata, "2*x", "y_max",
+        )
+        assert list(new_xdata) == list(2 * xdata)
+        assert list(new_ydata) == [3 + offset] * 4
+    assert utilities.compile_expression.cache_info().misses == 2
+
+
+def test_get_span():
+    """Test if get_span function ignores zeros and invalid values."""
+    assert DataHelper.get_span([0, 3, -2, float("nan"), 5]) == (-2, 5)
+    assert DataHelper.get_span([0, 0]) is None
+
+
+def test_execute_sorts_data():
+    """Test if executing an operation sorts x and y data together."""
+    item = SimpleNamespace(
+        props=SimpleNamespace(xdata=[0, 1, 2, 3], ydata=[0, 10, 20, 30]),
+        get_xposition=lambda: 0,
+    )
+    figure_settings = SimpleNamespace(
+        get_min_bottom=lambda: 0,
+        get_max_bottom=lambda: 3,
+    )
+    success, _message = DataOperations.execute(
+        item, "multiply_x", figure_settings, 0, -1,
+    )
+    assert success
+    assert item.props.xdata == [-3, -2, -1, 0]
+    assert item.props.ydata == [30, 20, 10, 0]
+
+
 def test_normalize():
     """Test if normalize function scales ydata to maximum value of 1."""
     xdata, ydata, _sort, _discard = \
@@ -0,0 +1,241 @@
+"""Tests for project files."""
+import json
+import pathlib
+from types import SimpleNamespace
+
+from graphs import arrays, file_io, project
+
+import pytest
+
+XDATA = [float(value) for value in range(20)]
+YDATA = [value / 2 for value in XDATA]
+
+
+class LocalFile():
+    """Stand-in for a Gio.File on the local file system."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def get_uri(self) -> str:
+        return self.path.as_uri()
+
+    def get_basename(self) -> str:
+        return self.path.name
+
+    def get_parent(self):
+        return LocalFile(self.path.parent)
+
+    def get_child(self, name: str):
+        return LocalFile(self.path / name)
+
+    def move(self, destination, *_args) -> None:
+        self.path.replace(destination.path)
+
+    def delete(self, _cancellable) -> None:
+        self.path.unlink()
+
+
+@pytest.fixture
+def project_file(tmp_path, monkeypatch):
+    """Get a project file that is read and written with the builtin open."""
+    monkeypatch.setattr(
+        file_io,
+        "gio_pyio",
+        SimpleNamespace(open=lambda file, mode: open(file.path, mode)),
+    )
+    return LocalFile(tmp_path / "project.graphs")
+
+
+def get_item(uuid: str, ydata: list) -> dict:
+    """Get the dict of a data item."""
+    return {"uuid": uuid, "name": uuid, "xdata": XDATA, "ydata": ydata}
+
+
+def get_state(uuid: str, old_ydata: list, new_ydata: list) -> list:
+    """Get a history state changing the y data of an item."""
+    return [[[0, [uuid, "ydata", old_ydata, new_ydata]]], [0, 1] * 4]
+
+
+def get_project_dict(data: list, history_states: list) -> dict:
+    """Get a project dict of the current version."""
+    return {
+        "version": "1.0",
+        "project-version": project.CURRENT_PROJECT_VERSION,
+        "data": data,
+        "figure-settings": {
+            f"{direction}_scale": 0
+            for direction in ("left", "right", "top", "bottom")
+        },
+        "history-states": history_states,
+        "history-position": -1,
+        "view-history-states": [],
+        "view-history-position": -1,
+        "history-arrays": {},
+    }
+
+
+def decode_states(project_dict: dict) -> list:
+    """Decode the history states of a project dict."""
+    return [
+        project.decode_history_state(state, project_dict["history-arrays"])
+        for state in project_dict["history-states"]
+    ]
+
+
+def test_encode_history_state():
+    """Test if encoding shares arrays and decodes to the original state."""
+    state = get_state("a", XDATA, YDATA)
+    state[0].append([0, ["b", "ydata", YDATA, list(XDATA)]])
+    stored_arrays = {}
+    encoded = project.encode_history_state(state, stored_arrays)
+    assert len(stored_arrays) == 2
+    digests = [arrays.get_digest(XDATA), arrays.get_digest(YDATA)]
+    assert sorted(project.get_array_references(encoded)) \
+        == sorted(digests * 2)
+    decoded = project.decode_history_state(encoded, stored_arrays)
+    assert decoded == json.loads(json.dumps(state))
+    # Identical arrays are decoded to the same interned array
+    assert decoded[0][0][1][2] is decoded[0][1][1][3]
+    assert isinstance(decoded[0][0][1][2], arrays.FrozenArray)
+
+
+def test_encode_history_state_short_lists():
+    """Test if short lists and non float lists are kept inline."""
+    state = [[[4, ["left-scale", 0, 1]]], [0.0, 1.0] * 4]
+    stored_arrays = {}
+    encoded = project.encode_history_state(state, stored_arrays)
+    assert stored_arrays == {}
+    assert project.decode_history_state(encoded, stored_arrays) \
+        == json.loads(json.dumps(state))
+
+
+@pytest.mark.parametrize("project_version", [None, 2])
+def test_migrate(project_version):
+    """Test if older projects are migrated to the current version."""
+    history_states = [get_state("a", XDATA, YDATA)]
+    project_dict = get_project_dict([get_item("a", YDATA)], history_states)
+    del project_dict["history-arrays"]
+    if project_version is None:
+        del project_dict["project-version"]
+        history_states.append([[[4, ["left-scale", 0, 2]]], [0, 1] * 4])
+    else:
+        project_dict["project-version"] = project_version
+    expected_states = json.loads(json.dumps(history_states))
+
+    migrated = project.ProjectMigrator(project_dict).migrate()
+    assert all(isinstance(state, str) for state in migrated["history-states"])
+    assert len(migrated["history-arrays"]) == 2
+    if project_version is None:
+        # The log2 scale was inserted at index 2
+        expected_states[1][0][0][1] = ["left-scale", 0, 3]
+    assert decode_states(migrated) == expected_states
+
+
+def test_migrate_newer_version():
+    """Test if projects from newer versions are refused."""
+    project_dict = get_project_dict([], [])
+    project_dict["project-version"] = project.CURRENT_PROJECT_VERSION + 1
+    with pytest.raises(project.ProjectParseError):
+        project.ProjectMigrator(project_dict).migrate()
+
+
+def write_project(project_file) -> dict:
+    """Save a project with two items and two history states."""
+    project_dict = get_project_dict(
+        [get_item("a", YDATA), get_item("b", YDATA)],
+        [get_state("a", XDATA, YDATA), get_state("b", XDATA, YDATA)],
+    )
+    project._write_project_dict(project_file, project_dict)
+    return project_dict
+
+
+def write_update(project_file) -> list:
+    """Append an update that changes item b and drops the first state."""
+    new_ydata = [value * 3 for value in XDATA]
+    history_states = [
+        get_state("b", XDATA, YDATA),
+        get_state("b", YDATA, new_ydata),
+    ]
+    project_update = get_project_dict(
+        ["a", get_item("b", new_ydata)],
+        history_states[1:],
+    )
+    project_update["history-dropped"] = 1
+    project_update["history-kept"] = 1
+    project._write_project_update(project_file, project_update)
+    return history_states
+
+
+def test_read_project(project_file):
+    """Test if a saved project is read back."""
+    write_project(project_file)
+    project_dict = project.read_project_file(project_file)
+    assert project_dict["project-updates"] == 0
+    assert [item["uuid"] for item in project_dict["data"]] == ["a", "b"]
+    assert decode_states(project_dict) == json.loads(json.dumps([
+        get_state("a", XDATA, YDATA), get_state("b", XDATA, YDATA),
+    ]))
+
+
+def test_read_project_updates(project_file):
+    """Test if appended updates are merged into the project."""
+    write_project(project_file)
+    history_states = write_update(project_file)
+    # Arrays that were already saved are not written again
+    documents, complete = file_io.parse_json_documents(project_file)
+    assert complete
+    assert len(documents) == 2
+    assert list(documents[1]["history-arrays"]) \
+        == [arrays.get_digest([value * 3 for value in XDATA])]
+
+    project_dict = project.read_project_file(project_file)
+    assert project_dict["project-updates"] == 1
+    assert project_dict["data"][0] == get_item("a", YDATA)
+    assert project_dict["data"][1]["ydata"] == [value * 3 for value in XDATA]
+    assert decode_states(project_dict) \
+        == json.loads(json.dumps(history_states))
+    for key in ("history-dropped", "history-kept"):
+        assert key not in project_dict
+
+
+def test_read_project_torn_update(project_file):
+    """Test if an update that was not written completely is ignored."""
+    write_project(project_file)
+    write_update(project_file)
+    data = project_file.path.read_bytes()
+    project_file.path.write_bytes(data[:-10])
+    project_dict = project.read_project_file(project_file)
+    assert project_dict["data"][1]["ydata"] == YDATA
+    assert len(project_dict["history-states"]) == 2
+    # Nothing may be appended after the torn update
+    assert project_dict["project-updates"] is None
+    with pytest.raises(RuntimeError):
+        write_update(project_file)
+
+    # The project is saved in full instead
+    project._write_project_dict(project_file, project_dict)
+    project_dict = project.read_project_file(project_file)
+    assert project_dict["project-updates"] == 0
+    assert len(project_dict["history-states"]) == 2
+
+
+def test_read_project_after_torn_update(project_file):
+    """Test if data appended after a torn update does not break the file."""
+    write_project(project_file)
+    write_update(project_file)
+    data = project_file.path.read_bytes()
+    # Cut off the checksum, such that the next member is read in its place
+    project_file.path.write_bytes(data[:-8])
+    file_io.append_json(project_file, {"data": []})
+    documents, complete = file_io.parse_json_documents(project_file)
+    assert not complete
+    assert len(documents) == 1
+
+
+def test_update_after_failed_write(project_file):
+    """Test if updates are refused once a write to the file failed."""
+    write_project(project_file)
+    project._SAVED_ARRAYS.pop(project_file.get_uri())
+    with pytest.raises(RuntimeError):
+        write_update(project_file)